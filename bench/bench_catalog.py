@@ -0,0 +1,64 @@
+"""Home page latency, time to first byte and peak memory from 1k to 1M ads.
+
+The keyset-paginated, streamed catalog should stay flat as the table grows;
+the ``Ad.query.all()`` column is the old implementation for comparison.
+
+    python bench/bench_catalog.py [--sizes 1000,10000,100000,1000000]
+"""
+import argparse
+
+from common import grow_ads, peak_memory, shop, table, timed
+
+import querycache
+
+
+def first_chunk(client, url):
+    response = client.get(url, buffered=False)
+    next(response.response)
+    response.close()
+
+
+def full_page(client, url):
+    client.get(url).get_data()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000')
+    parser.add_argument('--baseline-limit', type=int, default=100000, help='Maior tabela medida com Ad.query.all().')
+    args = parser.parse_args()
+
+    client = shop.app.test_client()
+    rows = []
+    for size in map(int, args.sizes.split(',')):
+        grow_ads(size)
+        with shop.app.app_context():
+            shop.build_facets()
+            middle = shop.db.session.query(shop.func.max(shop.Ad.id)).scalar() // 2
+
+        def cold(url):
+            shop.card_cache.clear()
+            shop.query_cache.backend = querycache.LocalBackend(shop.app.config['QUERY_CACHE_SIZE'])
+            full_page(client, url)
+
+        client.get('/')
+        baseline = '-'
+        if size <= args.baseline_limit:
+            with shop.app.app_context():
+                baseline = f'{timed(lambda: shop.Ad.query.all(), repeat=3):.1f}'
+        rows.append((
+            size,
+            f'{timed(lambda: cold("/")):.1f}',
+            f'{timed(lambda: cold(f"/?after={middle}")):.1f}',
+            f'{timed(lambda: full_page(client, "/")):.1f}',
+            f'{timed(lambda: first_chunk(client, "/")):.1f}',
+            f'{peak_memory(lambda: cold("/")):.0f}',
+            baseline,
+        ))
+        print(f'{size} anúncios medidos', flush=True)
+
+    table(('ads', 'frio ms', 'meio ms', 'quente ms', 'ttfb ms', 'pico KiB', 'all() ms'), rows)
+
+
+if __name__ == '__main__':
+    main()
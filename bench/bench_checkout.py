@@ -0,0 +1,76 @@
+"""Checkout latency and query count for carts of 1 to 1000 lines.
+
+``purchase_all`` locks only the buyer's cart rows, prices every line in one
+join and writes the purchases with a single executemany, so the number of
+queries should not grow with the cart.
+
+    python bench/bench_checkout.py [--lines 1,10,100,1000] [--repeat 10]
+"""
+import argparse
+import re
+import statistics
+import time
+
+from common import grow_ads, shop, table
+
+
+def buyer():
+    with shop.app.app_context():
+        user = shop.User.query.filter_by(username='comprador').first()
+        if user is None:
+            user = shop.User(username='comprador', password='bench')
+            shop.db.session.add(user)
+            shop.db.session.commit()
+        return user.id
+
+
+def fill_cart(user_id, lines):
+    with shop.app.app_context():
+        ad_ids = shop.db.session.scalars(shop.select(shop.Ad.id).order_by(shop.Ad.id).limit(lines)).all()
+        shop.db.session.execute(shop.insert(shop.CartItem), [
+            {'user_id': user_id, 'ad_id': ad_id, 'quantity': 1 + ad_id % 3} for ad_id in ad_ids
+        ])
+        shop.db.session.commit()
+
+
+def checkout(client):
+    started = time.perf_counter()
+    response = client.post('/purchase_all')
+    elapsed = (time.perf_counter() - started) * 1000
+    assert response.status_code == 302, response.status_code
+    timing = re.search(r'(\d+) queries', response.headers.get('Server-Timing', ''))
+    return elapsed, int(timing.group(1)) if timing else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--lines', default='1,10,100,1000')
+    parser.add_argument('--repeat', type=int, default=10)
+    args = parser.parse_args()
+
+    sizes = list(map(int, args.lines.split(',')))
+    grow_ads(max(sizes))
+    user_id = buyer()
+    client = shop.app.test_client()
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+
+    rows = []
+    for lines in sizes:
+        samples = []
+        for _ in range(args.repeat):
+            fill_cart(user_id, lines)
+            samples.append(checkout(client))
+        rows.append((
+            lines,
+            f'{statistics.median(elapsed for elapsed, _ in samples):.1f}',
+            f'{statistics.median(elapsed for elapsed, _ in samples) / lines:.2f}',
+            samples[-1][1],
+        ))
+        print(f'{lines} itens medidos', flush=True)
+
+    table(('itens', 'ms', 'ms/item', 'consultas'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Purchase history latency for buyers with 10k to 100k purchases.
+
+The history is served from one keyset-paginated query on the
+(user_id, date, id) index, so the first page and a page deep in the
+history should cost the same at every size. The ``all()`` column loads the
+whole history with a lazy ``purchase.ad`` per row, as the old page did.
+
+    python bench/bench_history.py [--sizes 10000,50000,100000]
+"""
+import argparse
+import random
+from datetime import datetime, timedelta
+
+from common import grow_ads, shop, table, timed
+
+
+def buyer(purchases, ad_ids, batch_size=10000):
+    """A user holding exactly ``purchases`` purchases over the last two years."""
+    name = f'historico{purchases}'
+    with shop.app.app_context():
+        user = shop.User.query.filter_by(username=name).first()
+        if user is not None:
+            return user.id
+        user = shop.User(username=name, password='bench')
+        shop.db.session.add(user)
+        shop.db.session.commit()
+
+        rng = random.Random(purchases)
+        start = datetime.utcnow() - timedelta(days=730)
+        for offset in range(0, purchases, batch_size):
+            shop.db.session.execute(shop.insert(shop.Purchase), [
+                {
+                    'date': start + timedelta(seconds=rng.randrange(730 * 86400)),
+                    'value': rng.randrange(10, 5000), 'user_id': user.id, 'ad_id': rng.choice(ad_ids),
+                }
+                for _ in range(min(batch_size, purchases - offset))
+            ])
+            shop.db.session.commit()
+        return user.id
+
+
+def middle_cursor(user_id):
+    with shop.app.app_context():
+        total = shop.Purchase.query.filter_by(user_id=user_id).count()
+        date, purchase_id = shop.db.session.query(shop.Purchase.date, shop.Purchase.id).filter(
+            shop.Purchase.user_id == user_id
+        ).order_by(shop.Purchase.date.desc(), shop.Purchase.id.desc()).offset(total // 2).first()
+        return f'{date.isoformat()}_{purchase_id}'
+
+
+def load_everything(user_id):
+    strict = shop.app.config['SQL_STRICT']
+    shop.app.config['SQL_STRICT'] = False
+    try:
+        with shop.app.app_context():
+            for purchase in shop.Purchase.query.filter_by(user_id=user_id).all():
+                purchase.ad.title
+    finally:
+        shop.app.config['SQL_STRICT'] = strict
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10000,50000,100000')
+    parser.add_argument('--baseline-limit', type=int, default=50000, help='Maior histórico medido com all().')
+    args = parser.parse_args()
+
+    grow_ads(1000)
+    with shop.app.app_context():
+        ad_ids = shop.db.session.scalars(shop.select(shop.Ad.id)).all()
+
+    client = shop.app.test_client()
+    rows = []
+    for size in map(int, args.sizes.split(',')):
+        user_id = buyer(size, ad_ids)
+        cursor = middle_cursor(user_id)
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+
+        baseline = '-'
+        if size <= args.baseline_limit:
+            baseline = f'{timed(lambda: load_everything(user_id), repeat=3):.1f}'
+        rows.append((
+            size,
+            f'{timed(lambda: client.get("/purchase_history").get_data()):.1f}',
+            f'{timed(lambda: client.get(f"/purchase_history?cursor={cursor}").get_data()):.1f}',
+            baseline,
+        ))
+        print(f'{size} compras medidas', flush=True)
+
+    table(('compras', 'primeira ms', 'meio ms', 'all() ms'), rows)
+
+
+if __name__ == '__main__':
+    main()
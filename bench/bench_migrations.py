@@ -0,0 +1,110 @@
+"""Route queries replayed before and after the schema migrations.
+
+Seeds a synthetic store, drops the indexes the migrations add, then times
+the queries behind the history, admin purchase filters, category browsing,
+questions and upload garbage collection with and without them. The plan column shows
+whether the engine used an index (SQLite EXPLAIN QUERY PLAN / MySQL EXPLAIN).
+
+    python bench/bench_migrations.py [--purchases 200000] [--ads 20000]
+"""
+import argparse
+from datetime import timedelta
+
+from common import shop, table, timed
+
+import migrations
+
+# Indexes added by migrations 2, 5 and 6. The unique cart/favorite indexes from
+# migration 3 stay: the cart upserts need them.
+INDEXES = {
+    'ix_ad_image_path': 'ad',
+    'ix_purchase_user_date': 'purchase',
+    'ix_purchase_ad': 'purchase',
+    'ix_purchase_date': 'purchase',
+    'ix_question_ad': 'question',
+    'ix_answer_question': 'answer',
+    'ix_ad_category': 'ad',
+    'ix_ad_user': 'ad',
+}
+INDEX_MIGRATIONS = (2, 5, 6)
+
+
+def route_queries():
+    Purchase, Question, Answer, Ad = shop.Purchase, shop.Question, shop.Answer, shop.Ad
+    session = shop.db.session
+    buyer = session.query(Purchase.user_id).group_by(Purchase.user_id).order_by(shop.func.count().desc()).limit(1).scalar()
+    popular = session.query(Purchase.ad_id).group_by(Purchase.ad_id).order_by(shop.func.count().desc()).limit(1).scalar()
+    day = shop.datetime.combine(session.query(shop.func.max(Purchase.date)).scalar().date(), shop.datetime.min.time())
+    question = session.query(Answer.question_id).limit(1).scalar()
+    asked = session.query(Question.ad_id).limit(1).scalar()
+    category = session.query(Ad.category_id).limit(1).scalar()
+    return {
+        'histórico': shop.select(Purchase.id, Purchase.date).where(Purchase.user_id == buyer)
+        .order_by(Purchase.date.desc(), Purchase.id.desc()).limit(21),
+        'admin por dia': shop.select(Purchase.id).where(Purchase.date >= day, Purchase.date < day + timedelta(days=1))
+        .order_by(Purchase.id.desc()).limit(21),
+        'admin por anúncio': shop.select(Purchase.id).where(Purchase.ad_id == popular)
+        .order_by(Purchase.id.desc()).limit(21),
+        'categoria': shop.select(Ad.id).where(Ad.category_id == category, Ad.price >= 100, Ad.price < 500)
+        .order_by(Ad.id.desc()).limit(25),
+        'perguntas': shop.select(Question.id).where(Question.ad_id == asked),
+        'respostas': shop.select(Answer.id).where(Answer.question_id == question),
+        'gc de uploads': shop.select(Ad.image_path).where(Ad.image_path.in_(['0' * 64 + '.jpg'])),
+    }
+
+
+def plan(conn, statement):
+    compiled = statement.compile(conn, compile_kwargs={'literal_binds': True})
+    if conn.dialect.name == 'mysql':
+        row = conn.exec_driver_sql(f'EXPLAIN {compiled}').mappings().first()
+        return row['key'] or 'varredura'
+    details = [row[-1] for row in conn.exec_driver_sql(f'EXPLAIN QUERY PLAN {compiled}')]
+    return '; '.join(details)
+
+
+def measure(queries, repeat):
+    with shop.db.engine.connect() as conn:
+        return {
+            name: (timed(lambda: conn.execute(statement).all(), repeat), plan(conn, statement))
+            for name, statement in queries.items()
+        }
+
+
+def drop_indexes():
+    with shop.db.engine.begin() as conn:
+        for name, table_name in INDEXES.items():
+            conn.exec_driver_sql(f'DROP INDEX {name} ON {table_name}' if conn.dialect.name == 'mysql' else f'DROP INDEX {name}')
+        conn.exec_driver_sql(f'DELETE FROM schema_migrations WHERE version IN {INDEX_MIGRATIONS}')
+    shop.db.engine.dispose()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--ads', type=int, default=20000)
+    parser.add_argument('--purchases', type=int, default=200000)
+    parser.add_argument('--questions', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with shop.app.app_context():
+        shop.seed_database(
+            42, users=args.users, ads=args.ads, purchases=args.purchases, questions=args.questions,
+            favorites=args.users, cart_items=args.users,
+        )
+        queries = route_queries()
+        shop.db.session.remove()
+        drop_indexes()
+        print('pendentes:', ', '.join(f'{version:03d}' for version, _ in migrations.pending(shop.db.engine)), flush=True)
+        before = measure(queries, args.repeat)
+        migrations.upgrade(shop.db.engine)
+        after = measure(queries, args.repeat)
+
+    table(('consulta', 'antes ms', 'depois ms', 'plano antes', 'plano depois'), [
+        (name, f'{before[name][0]:.2f}', f'{after[name][0]:.2f}', before[name][1], after[name][1])
+        for name in queries
+    ])
+
+
+if __name__ == '__main__':
+    main()
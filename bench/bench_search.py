@@ -0,0 +1,79 @@
+"""BM25 search index against a SQL ``LIKE '%term%'`` baseline.
+
+Ad text is drawn from a Zipf-distributed vocabulary of --vocabulary words
+(as in natural language), with the real product words from synthetic.py
+spread across the ranks, so queries hit both common and rare terms.
+
+    python bench/bench_search.py [--sizes 10000,100000,300000]
+"""
+import argparse
+import random
+import time
+
+from common import ensure_owner, shop, table, timed
+
+import synthetic
+
+QUERIES = ['notebook', 'cadeira usada', 'violão elétrico portátil', 'tenis']
+
+
+def vocabulary(size, seed=7):
+    rng = random.Random(seed)
+    words = [f'termo{n}' for n in range(size - len(synthetic.NOUNS) - len(synthetic.ADJECTIVES))]
+    for word in synthetic.NOUNS + synthetic.ADJECTIVES:
+        words.insert(rng.randrange(len(words) // 20), word)
+    return words, synthetic.zipf_weights(len(words), 1.0)
+
+
+def grow(total, words, weights, batch_size=10000):
+    user_id, category_id = ensure_owner()
+    rng = random.Random(total)
+    have = shop.Ad.query.count()
+    for start in range(have, total, batch_size):
+        shop.db.session.execute(shop.insert(shop.Ad), [
+            {
+                'title': ' '.join(rng.choices(words, cum_weights=weights, k=3)),
+                'description': ' '.join(rng.choices(words, cum_weights=weights, k=15)),
+                'price': 10, 'user_id': user_id, 'category_id': category_id,
+            }
+            for _ in range(start, min(start + batch_size, total))
+        ])
+        shop.db.session.commit()
+
+
+def like_search(q):
+    query = shop.Ad.query
+    for term in q.split():
+        pattern = f'%{term}%'
+        query = query.filter(shop.or_(shop.Ad.title.like(pattern), shop.Ad.description.like(pattern)))
+    return query.order_by(shop.Ad.id.desc()).limit(shop.app.config['ADS_PER_PAGE']).all()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='10000,100000,300000')
+    parser.add_argument('--vocabulary', type=int, default=20000)
+    args = parser.parse_args()
+
+    words, weights = vocabulary(args.vocabulary)
+    rows = []
+    with shop.app.app_context():
+        for size in map(int, args.sizes.split(',')):
+            grow(size, words, weights)
+            started = time.perf_counter()
+            shop.build_search_index()
+            build = time.perf_counter() - started
+            for q in QUERIES:
+                rows.append((
+                    size, q,
+                    f'{timed(lambda: shop.search_index.search(q, limit=shop.app.config["ADS_PER_PAGE"])):.2f}',
+                    f'{timed(lambda: like_search(q), repeat=3):.1f}',
+                    f'{build:.1f}',
+                ))
+            print(f'{size} anúncios medidos', flush=True)
+
+    table(('ads', 'consulta', 'bm25 ms', 'like ms', 'índice s'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+"""Job worker throughput by claim batch size.
+
+Each run enqueues --jobs receipt jobs, as checkouts of --lines lines would,
+and drains the queue with run_jobs(), reporting jobs per second. Claiming in
+larger batches amortizes the SELECT ... FOR UPDATE SKIP LOCKED and the
+claim UPDATE over more jobs.
+
+    python bench/bench_worker.py [--jobs 2000] [--batch-sizes 1,10,100,500]
+"""
+import argparse
+import logging
+import time
+from datetime import datetime
+
+from common import grow_ads, shop, table
+
+
+def buyer():
+    with shop.app.app_context():
+        user = shop.User.query.filter_by(username='fila').first()
+        if user is None:
+            user = shop.User(username='fila', password='bench')
+            shop.db.session.add(user)
+            shop.db.session.commit()
+        return user.id
+
+
+def enqueue_receipts(user_id, jobs, lines):
+    with shop.app.app_context():
+        ad_ids = shop.db.session.scalars(shop.select(shop.Ad.id).limit(lines)).all()
+        first = (shop.db.session.query(shop.func.max(shop.Purchase.id)).scalar() or 0) + 1
+        now = datetime.utcnow()
+        shop.db.session.execute(shop.insert(shop.Purchase), [
+            {'id': first + n, 'date': now, 'value': 10, 'user_id': user_id, 'ad_id': ad_ids[n % lines]}
+            for n in range(jobs * lines)
+        ])
+        for n in range(jobs):
+            start = first + n * lines
+            shop.enqueue('purchase.completed', user_id=user_id, purchase_ids=list(range(start, start + lines)))
+        shop.db.session.commit()
+
+
+def drain(batch_size):
+    done = 0
+    started = time.perf_counter()
+    with shop.app.app_context():
+        while claimed := shop.run_jobs('bench', batch_size):
+            done += claimed
+    return done, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--jobs', type=int, default=2000)
+    parser.add_argument('--lines', type=int, default=3, help='Compras por recibo.')
+    parser.add_argument('--batch-sizes', default='1,10,100,500')
+    args = parser.parse_args()
+
+    logging.getLogger(shop.app.logger.name).setLevel(logging.WARNING)
+    grow_ads(args.lines)
+    user_id = buyer()
+    rows = []
+    for batch_size in map(int, args.batch_sizes.split(',')):
+        enqueue_receipts(user_id, args.jobs, args.lines)
+        done, elapsed = drain(batch_size)
+        rows.append((batch_size, done, f'{elapsed:.2f}', f'{done / elapsed:.0f}'))
+        print(f'lote de {batch_size} medido', flush=True)
+
+    table(('lote', 'jobs', 's', 'jobs/s'), rows)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Shared setup for the benchmark scripts.
+
+Each script runs against a throwaway SQLite file unless DATABASE_URL points
+somewhere else (e.g. a scratch MySQL schema), so results can be compared on
+both engines with the same data.
+"""
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'ecommerce'))
+
+WORKDIR = tempfile.mkdtemp(prefix='ecommerce-bench-')
+os.environ.setdefault('DATABASE_URL', f'sqlite:///{os.path.join(WORKDIR, "bench.sqlite")}')
+os.environ.setdefault('UPLOAD_FOLDER', os.path.join(WORKDIR, 'uploads'))
+
+import app as shop  # noqa: E402
+
+shop.create_tables()
+
+
+def timed(fn, repeat=20):
+    """Median wall time of ``fn()`` in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+def peak_memory(fn):
+    """Peak Python allocation while running ``fn()``, in KiB."""
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1] / 1024
+    finally:
+        tracemalloc.stop()
+
+
+def table(headers, rows):
+    widths = [max(len(str(value)) for value in column) for column in zip(headers, *rows)]
+    for row in [headers, *rows]:
+        print('  '.join(str(value).rjust(width) for value, width in zip(row, widths)))
+
+
+def ensure_owner():
+    with shop.app.app_context():
+        user = shop.User.query.filter_by(username='bench').first()
+        if user is None:
+            user = shop.User(username='bench', password='bench', is_admin=True)
+            category = shop.Category(name='Bench')
+            shop.db.session.add_all([user, category])
+            shop.db.session.commit()
+        category = shop.Category.query.filter_by(name='Bench').first()
+        return user.id, category.id
+
+
+def grow_ads(total, batch_size=10000):
+    """Insert ads until the table holds ``total`` rows."""
+    user_id, category_id = ensure_owner()
+    with shop.app.app_context():
+        have = shop.Ad.query.count()
+        for start in range(have, total, batch_size):
+            shop.db.session.execute(shop.insert(shop.Ad), [
+                {
+                    'title': f'Anúncio {n}', 'description': f'Descrição do anúncio {n} em bom estado',
+                    'price': 10 + n % 5000, 'user_id': user_id, 'category_id': category_id,
+                }
+                for n in range(start, min(start + batch_size, total))
+            ])
+            shop.db.session.commit()
@@ -1,21 +1,68 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, g
+from flask import Flask, Request, render_template, stream_template, stream_with_context, jsonify, request, redirect, url_for, session, flash, g, get_flashed_messages
 from flask_sqlalchemy import SQLAlchemy
+from markupsafe import Markup
 from config import Config
-from datetime import datetime
+from cache import LRUCache, TTLCache
+from search import SearchIndex
+from facets import FacetCounts
+from versions import VersionTracker
+import sqlstats
+import assets
+import poolstats
+import replicas
+import migrations
+import querycache
+import synthetic
+from replicas import read_only, recently_wrote
+from sqlstats import query_budget
+from datetime import datetime, timedelta, timezone
 import os
-from werkzeug.utils import secure_filename
+import io
+import re
+import csv
+import json
+import math
+import zlib
+import time
+import socket
+import secrets
+import hashlib
+import tempfile
+import zipfile
+import multiprocessing
+import click
 from functools import wraps
-from sqlalchemy.orm import relationship
+from collections import Counter, namedtuple
+from PIL import Image, ImageFile, ImageOps
+from sqlalchemy import and_, case, delete, event, func, insert, or_, select, update
+from sqlalchemy.dialects.mysql import insert as mysql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import joinedload, relationship
 
 
 
 
 app = Flask(__name__)
 app.config.from_object('config.Config')
-app.config['UPLOAD_FOLDER'] = 'static/uploads'
+app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER') or os.path.join(app.root_path, 'static', 'uploads')
+app.config['QUERY_CACHE_DIR'] = app.config['QUERY_CACHE_DIR'] or os.path.join(app.instance_path, 'query-cache')
+app.config['IMPORT_FOLDER'] = app.config['IMPORT_FOLDER'] or os.path.join(app.instance_path, 'imports')
 app.config['ALLOWED_EXTENSIONS'] = {'png', 'jpg', 'jpeg', 'gif'}
 
-db = SQLAlchemy(app)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'].setdefault('poolclass', poolstats.MeteredQueuePool)
+
+db = SQLAlchemy(app, session_options={'class_': replicas.RoutingSession})
+sqlstats.init_app(app)
+poolstats.init_app(app, db)
+replicas.init_app(app)
+assets.init_app(app)
+
+card_cache = LRUCache(app.config['CARD_CACHE_SIZE'])
+identity_cache = TTLCache(app.config['IDENTITY_CACHE_SIZE'], app.config['IDENTITY_CACHE_TTL'])
+versions = VersionTracker(app.config['CATALOG_SYNC_SECONDS'])
+search_index = SearchIndex()
+facet_counts = FacetCounts(app.config['PRICE_BUCKETS'])
+query_cache = querycache.from_config(app.config)
 
 if not os.path.exists(app.config['UPLOAD_FOLDER']):
     os.makedirs(app.config['UPLOAD_FOLDER'])
@@ -25,24 +72,341 @@ def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in allowed_extensions
 
 
+def upsert_add(model, index_elements, rows):
+    columns = [column for column in rows[0] if column not in index_elements]
+    if db.engine.dialect.name == 'mysql':
+        stmt = mysql_insert(model).values(rows)
+        return stmt.on_duplicate_key_update({
+            column: getattr(model, column) + stmt.inserted[column] for column in columns
+        })
+
+    stmt = sqlite_insert(model).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=index_elements,
+        set_={column: getattr(model, column) + stmt.excluded[column] for column in columns},
+    )
+
+
+CachedCategory = namedtuple('CachedCategory', 'id name')
+CachedAd = namedtuple('CachedAd', 'id title description price image_path image_variants category_id')
+
+
+def all_categories():
+    # Shared caches are filled from the primary, so a lagging replica cannot
+    # put back data older than the write that invalidated them.
+    return query_cache.get_or_create('reference', 'categories', lambda: [
+        CachedCategory(*row) for row in db.session.execute(
+            select(Category.id, Category.name).order_by(Category.id), bind_arguments={'bind': db.engine}
+        )
+    ], tags=('category',))
+
+
+def touch_catalog(*ad_ids):
+    # The counter row serializes catalog writers, so versions commit in order
+    # and readers can follow catalog_change without missing a late commit.
+    db.session.execute(update(CatalogState).values(
+        version=CatalogState.version + 1, modified=datetime.utcnow().replace(microsecond=0)
+    ))
+    version = db.session.execute(select(CatalogState.version), bind_arguments={'bind': db.engine}).scalar_one()
+    db.session.execute(insert(CatalogChange), [{'version': version, 'ad_id': ad_id} for ad_id in ad_ids or (None,)])
+    db.session.execute(delete(CatalogChange).where(CatalogChange.version <= version - app.config['CATALOG_CHANGES_KEPT']))
+    db.session.info['catalog_touched'] = True
+    return version
+
+
+@event.listens_for(replicas.RoutingSession, 'after_commit')
+def catalog_committed(session):
+    if session.info.pop('catalog_touched', False):
+        versions.expire()
+
+
+@event.listens_for(replicas.RoutingSession, 'after_rollback')
+def catalog_rolled_back(session):
+    session.info.pop('catalog_touched', None)
+
+
+def ad_saved(ad):
+    db.session.flush()
+    touch_catalog(ad.id)
+
+
+def ad_deleted(ad_id):
+    touch_catalog(ad_id)
+
+
+def utc(value):
+    return value.replace(tzinfo=timezone.utc)
+
+
+def sync_catalog():
+    if not versions.due():
+        return
+    with versions.lock, sqlstats.unbudgeted():
+        if not versions.due():
+            return
+        with db.engine.connect() as conn:
+            version, modified = conn.execute(select(CatalogState.version, CatalogState.modified)).one()
+            seen = versions.catalog_version
+            if seen is None:
+                versions.reset(version, utc(modified))
+                return
+            if version == seen:
+                versions.apply([], version, utc(modified))
+                return
+
+            changes = conn.execute(
+                select(CatalogChange.version, CatalogChange.ad_id)
+                .where(CatalogChange.version > seen).order_by(CatalogChange.version)
+            ).all()
+            if not changes or changes[0].version > seen + 1 or any(ad_id is None for _, ad_id in changes):
+                search_index.built = facet_counts.built = False
+                versions.reset(version, utc(modified))
+                return
+
+            ad_ids = sorted({ad_id for _, ad_id in changes})
+            for start in range(0, len(ad_ids), 1000):
+                chunk = ad_ids[start:start + 1000]
+                rows = {row.id: row for row in conn.execute(
+                    select(Ad.id, Ad.title, Ad.description, Ad.category_id, Ad.price).where(Ad.id.in_(chunk))
+                )}
+                for ad_id in chunk:
+                    row = rows.get(ad_id)
+                    if row is None:
+                        search_index.remove(ad_id)
+                        facet_counts.remove(ad_id)
+                    else:
+                        search_index.add(ad_id, f'{row.title} {row.description}')
+                        facet_counts.add(ad_id, row.category_id, row.price)
+            versions.apply(changes, version, utc(modified))
+
+
+def catalog_source():
+    if 'catalog_source' not in g:
+        version, modified = db.session.query(CatalogState.version, CatalogState.modified).one()
+        g.catalog_source = (version, utc(modified))
+    return g.catalog_source
+
+
+def build_search_index():
+    with versions.lock:
+        rows = db.session.execute(
+            select(Ad.id, Ad.title, Ad.description).execution_options(yield_per=1000), bind_arguments={'bind': db.engine}
+        )
+        search_index.build((ad_id, f'{title} {description}') for ad_id, title, description in rows)
+
+
+def build_facets():
+    with versions.lock:
+        facet_counts.build(db.session.execute(
+            select(Ad.id, Ad.category_id, Ad.price).execution_options(yield_per=1000), bind_arguments={'bind': db.engine}
+        ))
+
+
+IMAGE_EXTENSIONS = {'JPEG': '.jpg', 'PNG': '.png', 'GIF': '.gif'}
+UPLOAD_TMP_PREFIX = '.upload-'
+IMAGE_HEADER_MAX_BYTES = 1024 * 1024
+
+
+class UploadRejected(ValueError):
+    pass
+
+
+class HashingUpload:
+    """Writes an uploaded image straight into the upload folder, hashing it
+    and checking its header while the request body is being parsed."""
+
+    def __init__(self, upload_folder, max_bytes, max_pixels):
+        self.file = tempfile.NamedTemporaryFile(dir=upload_folder, prefix=UPLOAD_TMP_PREFIX, delete=False)
+        self.max_bytes = max_bytes
+        self.max_pixels = max_pixels
+        self.digest = hashlib.sha256()
+        self.parser = ImageFile.Parser()
+        self.header = None
+        self.size = 0
+        self.error = None
+
+    def write(self, chunk):
+        if self.error is not None:
+            return len(chunk)
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            self.error = f'A imagem excede o limite de {self.max_bytes // (1024 * 1024)} MB.'
+            return len(chunk)
+        if self.header is None:
+            self.parser.feed(chunk)
+            self.header = self.parser.image
+            if self.header is None and self.size > IMAGE_HEADER_MAX_BYTES:
+                self.error = 'O arquivo enviado não é uma imagem válida.'
+            elif self.header is not None and self.header.format not in IMAGE_EXTENSIONS:
+                self.error = 'Formato de imagem não suportado.'
+            elif self.header is not None and self.header.width * self.header.height > self.max_pixels:
+                self.error = 'A imagem tem resolução grande demais.'
+        self.digest.update(chunk)
+        return self.file.write(chunk)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+    def close(self):
+        self.file.close()
+        if os.path.exists(self.file.name):
+            os.remove(self.file.name)
+
+
+def hashing_upload():
+    return HashingUpload(app.config['UPLOAD_FOLDER'], app.config['UPLOAD_MAX_BYTES'], app.config['UPLOAD_MAX_PIXELS'])
+
+
+class UploadRequest(Request):
+    @property
+    def max_content_length(self):
+        if self.endpoint == 'import_ads_view':
+            return app.config['IMPORT_MAX_BYTES']
+        return super().max_content_length
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        if filename and allowed_file(filename):
+            return hashing_upload()
+        return super()._get_file_stream(total_content_length, content_type, filename, content_length)
+
+
+app.request_class = UploadRequest
+
+
+def store_image(image):
+    upload = image.stream
+    try:
+        if not isinstance(upload, HashingUpload):
+            upload = hashing_upload()
+            for chunk in iter(lambda: image.stream.read(64 * 1024), b''):
+                upload.write(chunk)
+                if upload.error is not None:
+                    break
+        upload.file.close()
+        if upload.error is not None:
+            raise UploadRejected(upload.error)
+        if upload.header is None:
+            raise UploadRejected('O arquivo enviado não é uma imagem válida.')
+
+        upload_folder = app.config['UPLOAD_FOLDER']
+        filename = upload.digest.hexdigest() + IMAGE_EXTENSIONS[upload.header.format]
+        if os.path.exists(os.path.join(upload_folder, filename)):
+            os.utime(os.path.join(upload_folder, filename))
+        else:
+            os.replace(upload.file.name, os.path.join(upload_folder, filename))
+        return filename
+    finally:
+        upload.close()
+
+
+def attach_image(ad, image):
+    image_path = store_image(image)
+    ad.image_path = image_path
+    with db.session.no_autoflush:
+        ad.image_variants = db.session.query(Ad.image_variants).filter(
+            Ad.image_path == image_path, Ad.image_variants.isnot(None)
+        ).limit(1).scalar()
+    if ad.image_variants is None:
+        db.session.flush()
+        enqueue('image.variants', ad_id=ad.id, image_path=image_path)
+
+
+def variant_path(image_path, width, ext=None):
+    stem, original_ext = os.path.splitext(image_path)
+    return f'variants/{stem}-{width}{ext or original_ext}'
+
+
+@app.template_global()
+def image_srcset(ad, ext=None):
+    return ', '.join(
+        f"{url_for('uploaded_file', filename=variant_path(ad.image_path, width, ext))} {width}w"
+        for width in ad.image_variants.split(',')
+    )
+
+
+@app.template_global()
+def ad_card(ad):
+    # Keyed on the row's own fields, not on the process's idea of the current
+    # version, so a stale row (lagging replica, another worker) never gets
+    # cached as the fresh card.
+    key = (ad.id, ad.title, ad.description, ad.price, ad.image_path, ad.image_variants)
+    html = card_cache.get(key)
+    if html is None:
+        html = Markup(render_template('_ad_card.html', ad=ad))
+        card_cache.set(key, html)
+    return html
+
+
+def conditional(get_state):
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            # Flashes and the writer's own next pages must not be answered
+            # with a 304 from a version this process has not synced yet.
+            if '_flashes' in session or recently_wrote():
+                return f(*args, **kwargs)
+
+            sync_catalog()
+            version, modified = get_state(**kwargs)
+            etag = hashlib.sha1(f'{request.full_path}:{session.get("user_id")}:{version}'.encode()).hexdigest()
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains(etag)
+            else:
+                not_modified = request.if_modified_since is not None and modified <= request.if_modified_since
+
+            if not_modified:
+                response = app.response_class(status=304)
+            else:
+                # Label the page with the version of the database it is read
+                # from, which may still be behind the synced version.
+                source = catalog_source()
+                if source[0] < version:
+                    version, modified = source
+                    etag = hashlib.sha1(f'{request.full_path}:{session.get("user_id")}:{version}'.encode()).hexdigest()
+                response = app.make_response(f(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag)
+                response.last_modified = modified
+                response.cache_control.private = True
+                response.cache_control.no_cache = True
+            return response
+        return decorated_function
+    return decorator
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    limit = app.config['IMPORT_MAX_BYTES' if request.endpoint == 'import_ads_view' else 'UPLOAD_MAX_BYTES']
+    flash(f'O envio excede o limite de {limit // (1024 * 1024)} MB.', 'danger')
+    return redirect(request.referrer or url_for('index'))
+
+
 def admin_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        if 'user_id' not in session or not User.query.get(session['user_id']).is_admin:
+        user = current_user()
+        if user is None or not user.is_admin:
             flash('Você não tem permissão para acessar essa página.', 'danger')
             return redirect(url_for('index'))
         return f(*args, **kwargs)
     return decorated_function
 
 
-@app.before_request
-def load_logged_in_user():
-    user_id = session.get('user_id')
-
-    if user_id is None:
+@app.template_global()
+def current_user():
+    if 'current_user' not in g:
         g.current_user = None
-    else:
-        g.current_user = User.query.get(user_id)
+        user_id = session.get('user_id')
+        if user_id is not None:
+            identity = identity_cache.get(user_id)
+            if identity is None:
+                user = db.session.get(User, user_id, bind_arguments={'bind': db.engine})
+                if user:
+                    identity = Identity(user.id, user.username, user.is_admin)
+                    identity_cache.set(user_id, identity)
+            g.current_user = identity
+    return g.current_user
+
 
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -51,6 +415,15 @@ class User(db.Model):
     is_admin = db.Column(db.Boolean, default=False)
 
 
+Identity = namedtuple('Identity', 'id username is_admin')
+
+
+@event.listens_for(User, 'after_update')
+@event.listens_for(User, 'after_delete')
+def forget_identity(mapper, connection, user):
+    identity_cache.delete(user.id)
+
+
 class Product(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(100), nullable=False)
@@ -67,12 +440,18 @@ class Ad(db.Model):
     price = db.Column(db.Float, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     category_id = db.Column(db.Integer, db.ForeignKey('category.id'), nullable=False)
-    image_path = db.Column(db.String(255))
+    image_path = db.Column(db.String(255), index=True)
+    image_variants = db.Column(db.String(255))
     
     user = relationship('User', backref='ads')
     category = relationship('Category', backref='ads')
     purchases = relationship('Purchase', backref='ad', cascade='all, delete-orphan')
 
+    __table_args__ = (
+        db.Index('ix_ad_category', 'category_id', 'id'),
+        db.Index('ix_ad_user', 'user_id'),
+    )
+
 
 class Question(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -84,6 +463,8 @@ class Question(db.Model):
     user = db.relationship('User', backref=db.backref('questions', lazy=True))
     ad = db.relationship('Ad', backref=db.backref('questions', lazy=True))
 
+    __table_args__ = (db.Index('ix_question_ad', 'ad_id'),)
+
 class Answer(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     text = db.Column(db.Text, nullable=False)
@@ -94,6 +475,8 @@ class Answer(db.Model):
     user = db.relationship('User', backref=db.backref('answers', lazy=True))
     question = db.relationship('Question', backref=db.backref('answers', lazy=True))
 
+    __table_args__ = (db.Index('ix_answer_question', 'question_id'),)
+
 class Favorite(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -102,13 +485,64 @@ class Favorite(db.Model):
     user = db.relationship('User', backref=db.backref('favorites', lazy=True))
     ad = db.relationship('Ad', backref=db.backref('favorites', lazy=True))
 
+    __table_args__ = (db.UniqueConstraint('user_id', 'ad_id', name='uq_favorite_user_ad'),)
+
 class Purchase(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     date = db.Column(db.DateTime, nullable=False)
     value = db.Column(db.Float, nullable=False)
+    quantity = db.Column(db.Integer, default=1, nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     ad_id = db.Column(db.Integer, db.ForeignKey('ad.id'), nullable=False)
 
+    __table_args__ = (
+        db.Index('ix_purchase_user_date', 'user_id', 'date', 'id'),
+        db.Index('ix_purchase_ad', 'ad_id'),
+        db.Index('ix_purchase_date', 'date', 'id'),
+    )
+
+class Job(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(16), default='pending', nullable=False)
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_by = db.Column(db.String(64))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (db.Index('ix_job_status_run_at', 'status', 'run_at'),)
+
+class CatalogState(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, default=0, nullable=False)
+    modified = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+class CatalogChange(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column(db.Integer, nullable=False)
+    ad_id = db.Column(db.Integer)
+
+    __table_args__ = (db.Index('ix_catalog_change_version', 'version'),)
+
+class ImportCheckpoint(db.Model):
+    source = db.Column(db.String(255), primary_key=True)
+    rows = db.Column(db.Integer, default=0, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+class DailySales(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    sales = db.Column(db.Integer, default=0, nullable=False)
+    revenue = db.Column(db.Float, default=0, nullable=False)
+
+class AdSales(db.Model):
+    ad_id = db.Column(db.Integer, db.ForeignKey('ad.id'), primary_key=True)
+    sales = db.Column(db.Integer, default=0, nullable=False)
+    revenue = db.Column(db.Float, default=0, nullable=False)
+    ad = db.relationship('Ad')
+
 class CartItem(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     ad_id = db.Column(db.Integer, db.ForeignKey('ad.id'), nullable=False)
@@ -117,17 +551,534 @@ class CartItem(db.Model):
     ad = db.relationship('Ad', backref='cart_items')
     user = db.relationship('User', backref='cart_items')
 
+    __table_args__ = (db.UniqueConstraint('user_id', 'ad_id', name='uq_cart_item_user_ad'),)
+
+
+
+
+def record_sales(date, lines):
+    db.session.execute(upsert_add(DailySales, ['day'], [
+        dict(day=date.date(), sales=sum(quantity for _, quantity, _ in lines), revenue=sum(value for _, _, value in lines))
+    ]))
+    db.session.execute(upsert_add(AdSales, ['ad_id'], [
+        dict(ad_id=ad_id, sales=quantity, revenue=value) for ad_id, quantity, value in lines
+    ]))
+
+
+def forget_ad_sales(ad_id):
+    day = func.date(Purchase.date)
+    rows = db.session.query(day, func.sum(Purchase.quantity), func.sum(Purchase.value)).filter(
+        Purchase.ad_id == ad_id
+    ).group_by(day).all()
+    for purchase_day, sales, revenue in rows:
+        DailySales.query.filter(DailySales.day == purchase_day).update({
+            DailySales.sales: DailySales.sales - sales,
+            DailySales.revenue: DailySales.revenue - revenue,
+        }, synchronize_session=False)
+    if rows:
+        DailySales.query.filter(
+            DailySales.day.in_([purchase_day for purchase_day, _, _ in rows]), DailySales.sales <= 0
+        ).delete(synchronize_session=False)
+    AdSales.query.filter_by(ad_id=ad_id).delete(synchronize_session=False)
+
+
+def rebuild_sales():
+    day = func.date(Purchase.date)
+    DailySales.query.delete()
+    AdSales.query.delete()
+    db.session.execute(insert(DailySales).from_select(
+        ['day', 'sales', 'revenue'],
+        db.select(day, func.sum(Purchase.quantity), func.sum(Purchase.value)).group_by(day),
+    ))
+    db.session.execute(insert(AdSales).from_select(
+        ['ad_id', 'sales', 'revenue'],
+        db.select(Purchase.ad_id, func.sum(Purchase.quantity), func.sum(Purchase.value)).group_by(Purchase.ad_id),
+    ))
+    db.session.commit()
+
+
+@app.cli.command('rebuild-sales')
+def rebuild_sales_command():
+    rebuild_sales()
+    print(f'{DailySales.query.count()} dias e {AdSales.query.count()} anúncios resumidos.')
+
+
+job_handlers = {}
+
+
+def job_handler(kind):
+    def decorator(f):
+        job_handlers[kind] = f
+        return f
+    return decorator
+
+
+def enqueue(kind, **payload):
+    db.session.add(Job(kind=kind, payload=json.dumps(payload)))
 
 
+def claim_jobs(worker_id, limit):
+    token = f'{worker_id[:50]}:{secrets.token_hex(6)}'
+    now = datetime.utcnow()
+    lease_expired = now - timedelta(seconds=app.config['JOB_LEASE_SECONDS'])
+    ready = or_(
+        and_(Job.status == 'pending', Job.run_at <= now),
+        and_(Job.status == 'running', Job.locked_at < lease_expired),
+    )
+    ids = [job_id for job_id, in db.session.query(Job.id).filter(ready).order_by(Job.id).limit(limit).with_for_update(skip_locked=True)]
+    if ids:
+        Job.query.filter(Job.id.in_(ids), ready).update(
+            {Job.status: 'running', Job.locked_by: token, Job.locked_at: now}, synchronize_session=False
+        )
+    db.session.commit()
+    if not ids:
+        return []
+    return Job.query.filter(Job.id.in_(ids), Job.locked_by == token).order_by(Job.id).all()
+
+
+def renew_job_lease():
+    job_id, token = g.get('job', (None, None))
+    if job_id is None:
+        return
+    renewed = Job.query.filter_by(id=job_id, locked_by=token).update(
+        {Job.locked_at: datetime.utcnow()}, synchronize_session=False
+    )
+    if not renewed:
+        raise RuntimeError(f'O job {job_id} foi reservado por outro processo.')
+
+
+def run_jobs(worker_id, limit):
+    jobs = claim_jobs(worker_id, limit)
+    for job in jobs:
+        job_id, kind, payload, token = job.id, job.kind, json.loads(job.payload), job.locked_by
+        g.job = job_id, token
+        try:
+            job_handlers[kind](**payload)
+            db.session.delete(job)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(Job, job_id)
+            if job is None or job.locked_by != token:
+                app.logger.warning('Job %s (%s) falhou após perder a reserva: %r', job_id, kind, e)
+                continue
+            job.attempts += 1
+            job.last_error = repr(e)
+            job.locked_by = job.locked_at = None
+            if job.attempts >= app.config['JOB_MAX_ATTEMPTS']:
+                job.status = 'dead'
+                app.logger.error('Job %s (%s) movido para a fila morta: %r', job_id, kind, e)
+            else:
+                job.status = 'pending'
+                job.run_at = datetime.utcnow() + timedelta(seconds=2 ** job.attempts)
+            db.session.commit()
+        finally:
+            g.pop('job', None)
+    return len(jobs)
+
+
+def work(batch_size, poll_interval, drain):
+    worker_id = f'{socket.gethostname()}:{os.getpid()}'
+    while True:
+        done = run_jobs(worker_id, batch_size)
+        if not done:
+            if drain:
+                return
+            time.sleep(poll_interval)
+
+
+def work_in_child(batch_size, poll_interval, drain):
+    with app.app_context():
+        db.engine.dispose(close=False)
+        work(batch_size, poll_interval, drain)
+
+
+@app.cli.command('worker')
+@click.option('--batch-size', type=int, default=None, help='Jobs reservados por vez.')
+@click.option('--poll-interval', type=float, default=1.0, help='Segundos de espera com a fila vazia.')
+@click.option('--processes', type=int, default=1, help='Número de processos de trabalho.')
+@click.option('--drain', is_flag=True, help='Sai quando a fila estiver vazia.')
+def worker_command(batch_size, poll_interval, processes, drain):
+    batch_size = batch_size or app.config['JOB_BATCH_SIZE']
+    if processes == 1:
+        work(batch_size, poll_interval, drain)
+        return
+
+    children = [
+        multiprocessing.Process(target=work_in_child, args=(batch_size, poll_interval, drain))
+        for _ in range(processes)
+    ]
+    for child in children:
+        child.start()
+    for child in children:
+        child.join()
+
+
+@job_handler('image.variants')
+def make_image_variants(ad_id, image_path):
+    ad = db.session.get(Ad, ad_id)
+    if ad is None or ad.image_path != image_path:
+        return
+
+    upload_folder = app.config['UPLOAD_FOLDER']
+    os.makedirs(os.path.join(upload_folder, 'variants'), exist_ok=True)
+    widths = []
+    with Image.open(os.path.join(upload_folder, image_path)) as original:
+        image_format = original.format
+        original = ImageOps.exif_transpose(original)
+        for width in sorted(app.config['IMAGE_VARIANT_WIDTHS']):
+            if width >= original.width:
+                break
+            variant = original.resize((width, round(original.height * width / original.width)), Image.LANCZOS)
+            if variant.mode not in ('RGB', 'RGBA'):
+                variant = variant.convert('RGBA' if 'transparency' in variant.info else 'RGB')
+            if image_format == 'JPEG' and variant.mode != 'RGB':
+                variant = variant.convert('RGB')
+            variant.save(os.path.join(upload_folder, variant_path(image_path, width)), format=image_format, optimize=True)
+            variant.save(os.path.join(upload_folder, variant_path(image_path, width, '.webp')), format='WEBP', quality=80)
+            widths.append(str(width))
+
+    ad_ids = [ad_id for ad_id, in db.session.query(Ad.id).filter(Ad.image_path == image_path)]
+    Ad.query.filter(Ad.image_path == image_path).update(
+        {Ad.image_variants: ','.join(widths)}, synchronize_session=False
+    )
+    touch_catalog(*ad_ids)
+    db.session.commit()
+
+
+def remove_upload(path, cutoff, dry_run=False):
+    full_path = os.path.join(app.config['UPLOAD_FOLDER'], path)
+    try:
+        stat = os.stat(full_path)
+        if stat.st_mtime > cutoff:
+            return 0
+        if not dry_run:
+            os.remove(full_path)
+        return stat.st_size
+    except FileNotFoundError:
+        return 0
+
+
+@job_handler('image.release')
+def release_image(image_path):
+    if db.session.query(Ad.id).filter(Ad.image_path == image_path).first() is not None:
+        return 0
+
+    cutoff = time.time() - app.config['UPLOAD_GC_GRACE_SECONDS']
+    paths = [image_path] + [
+        variant_path(image_path, width, ext)
+        for width in app.config['IMAGE_VARIANT_WIDTHS'] for ext in (None, '.webp')
+    ]
+    return sum(remove_upload(path, cutoff) for path in paths)
+
+
+def upload_owner(path):
+    stem = os.path.splitext(path)[0]
+    if stem.startswith('variants/'):
+        stem = stem[len('variants/'):].rsplit('-', 1)[0]
+    return stem
+
+
+def collect_orphan_uploads(batch_size=500, dry_run=False):
+    upload_folder = app.config['UPLOAD_FOLDER']
+    cutoff = time.time() - app.config['UPLOAD_GC_GRACE_SECONDS']
+    extensions = set(IMAGE_EXTENSIONS.values()) | {'.jpeg'}
+    extensions |= {ext.upper() for ext in extensions}
+    removed = reclaimed = 0
+    batch = {}
+
+    def sweep():
+        nonlocal removed, reclaimed
+        candidates = {stem + ext for stem in batch for ext in extensions}
+        candidates.update(path for paths in batch.values() for path in paths if '/' not in path)
+        referenced = {
+            upload_owner(image_path)
+            for image_path, in db.session.query(Ad.image_path).filter(Ad.image_path.in_(candidates))
+        }
+        for stem, paths in batch.items():
+            if stem in referenced:
+                continue
+            for path in paths:
+                size = remove_upload(path, cutoff, dry_run)
+                if size:
+                    removed += 1
+                    reclaimed += size
+        batch.clear()
+
+    for root, _, files in os.walk(upload_folder):
+        for name in files:
+            path = os.path.relpath(os.path.join(root, name), upload_folder).replace(os.sep, '/')
+            if name.startswith(UPLOAD_TMP_PREFIX):
+                size = remove_upload(path, cutoff, dry_run)
+                removed += bool(size)
+                reclaimed += size
+                continue
+            batch.setdefault(upload_owner(path), []).append(path)
+            if len(batch) >= batch_size:
+                sweep()
+    if batch:
+        sweep()
+    return removed, reclaimed
+
+
+@app.cli.command('gc-uploads')
+@click.option('--batch-size', type=int, default=500, help='Imagens verificadas por consulta.')
+@click.option('--dry-run', is_flag=True, help='Apenas informa o que seria removido.')
+def gc_uploads_command(batch_size, dry_run):
+    removed, reclaimed = collect_orphan_uploads(batch_size, dry_run)
+    action = 'seriam removidos' if dry_run else 'removidos'
+    print(f'{removed} arquivos órfãos {action} ({reclaimed / (1024 * 1024):.1f} MB).')
+
+
+@job_handler('purchase.completed')
+def send_receipt(user_id, purchase_ids):
+    count, total = db.session.query(func.count(Purchase.id), func.sum(Purchase.value)).filter(
+        Purchase.user_id == user_id, Purchase.id.in_(purchase_ids)
+    ).one()
+    app.logger.info('Recibo do usuário %s: %d itens, total R$ %.2f', user_id, count, total or 0)
+
+
+@app.cli.command('migrate')
+@click.option('--status', is_flag=True, help='Lista as migrações pendentes sem aplicá-las.')
+def migrate_command(status):
+    db.create_all()
+    if status:
+        for version, description in migrations.pending(db.engine):
+            print(f'pendente: {version:03d} {description}')
+        return
+    for version, description in migrations.upgrade(db.engine):
+        print(f'aplicada: {version:03d} {description}')
+
+
+def next_id(model):
+    return (db.session.query(func.max(model.id)).scalar() or 0) + 1
+
+
+def seed_rows(model, rows, batch_size, report=None):
+    started = time.monotonic()
+    count = 0
+    for batch in synthetic.batched(rows, batch_size):
+        db.session.execute(insert(model), batch)
+        db.session.commit()
+        count += len(batch)
+    if report:
+        report(model.__tablename__, count, count / max(time.monotonic() - started, 1e-6))
+    return count
+
+
+def seed_database(seed, users=1000, categories=20, ads=10000, favorites=20000, cart_items=5000,
+                  purchases=100000, questions=10000, answer_rate=0.7, end=None, days=365, zipf=1.1,
+                  batch_size=5000, report=None):
+    end = end or datetime(2024, 12, 31).date()
+    calendar = synthetic.SeasonalCalendar(end - timedelta(days=days - 1), end)
+
+    rng = synthetic.stream(seed, 'users')
+    first_user = next_id(User)
+    user_ids = range(first_user, first_user + users)
+    buyer_weights = synthetic.pareto_weights(rng, users)
+    seller_ids = rng.sample(user_ids, max(1, users // 10))
+    seller_weights = synthetic.pareto_weights(rng, len(seller_ids))
+    seed_rows(User, (
+        {'id': user_id, 'username': f'user{user_id}', 'password': 'senha', 'is_admin': False}
+        for user_id in user_ids
+    ), batch_size, report)
+
+    first_category = next_id(Category)
+    category_ids = range(first_category, first_category + categories)
+    seed_rows(Category, (
+        {'id': category_id, 'name': synthetic.category_name(n)} for n, category_id in enumerate(category_ids)
+    ), batch_size, report)
+    query_cache.invalidate('category')
+
+    rng = synthetic.stream(seed, 'ads')
+    first_ad = next_id(Ad)
+    ad_ids = range(first_ad, first_ad + ads)
+    prices = [synthetic.ad_price(rng) for _ in ad_ids]
+    owners = rng.choices(seller_ids, cum_weights=seller_weights, k=ads)
+    ad_categories = rng.choices(category_ids, cum_weights=synthetic.zipf_weights(categories, zipf), k=ads)
+    popular = rng.sample(ad_ids, ads)
+    popularity = synthetic.zipf_weights(ads, zipf)
+    seed_rows(Ad, (
+        {
+            'id': ad_id, 'title': synthetic.ad_title(rng), 'description': synthetic.ad_description(rng),
+            'price': prices[n], 'user_id': owners[n], 'category_id': ad_categories[n],
+        }
+        for n, ad_id in enumerate(ad_ids)
+    ), batch_size, report)
+    touch_catalog()
+    db.session.commit()
+
+    def pairs(name, count):
+        rng = synthetic.stream(seed, name)
+        per_user = Counter(rng.choices(user_ids, cum_weights=buyer_weights, k=count))
+        for user_id in sorted(per_user):
+            wanted = min(per_user[user_id], ads)
+            picks = dict.fromkeys(rng.choices(popular, cum_weights=popularity, k=wanted * 2))
+            for ad_id in list(picks)[:wanted]:
+                yield rng, user_id, ad_id
+
+    seed_rows(Favorite, (
+        {'user_id': user_id, 'ad_id': ad_id} for _, user_id, ad_id in pairs('favorites', favorites)
+    ), batch_size, report)
+    seed_rows(CartItem, (
+        {'user_id': user_id, 'ad_id': ad_id, 'quantity': rng.choices((1, 2, 3, 4, 5), (60, 20, 10, 5, 5))[0]}
+        for rng, user_id, ad_id in pairs('cart', cart_items)
+    ), batch_size, report)
+
+    def purchase_rows():
+        rng = synthetic.stream(seed, 'purchases')
+        for start in range(0, purchases, batch_size):
+            k = min(batch_size, purchases - start)
+            buyers = rng.choices(user_ids, cum_weights=buyer_weights, k=k)
+            items = rng.choices(popular, cum_weights=popularity, k=k)
+            for user_id, ad_id, date in zip(buyers, items, calendar.sample(rng, k)):
+                yield {'date': date, 'value': prices[ad_id - first_ad], 'user_id': user_id, 'ad_id': ad_id}
+
+    seed_rows(Purchase, purchase_rows(), batch_size, report)
+
+    rng = synthetic.stream(seed, 'questions')
+    next_question = next_id(Question)
+    asked = answered = 0
+    started = time.monotonic()
+    for start in range(0, questions, batch_size):
+        k = min(batch_size, questions - start)
+        askers = rng.choices(user_ids, cum_weights=buyer_weights, k=k)
+        items = rng.choices(popular, cum_weights=popularity, k=k)
+        question_rows = [
+            {'id': next_question + n, 'text': synthetic.question_text(rng), 'created_at': date, 'user_id': user_id, 'ad_id': ad_id}
+            for n, (user_id, ad_id, date) in enumerate(zip(askers, items, calendar.sample(rng, k)))
+        ]
+        answer_rows = [
+            {
+                'text': synthetic.answer_text(rng),
+                'created_at': question['created_at'] + timedelta(minutes=rng.expovariate(1 / 600)),
+                'user_id': owners[question['ad_id'] - first_ad],
+                'question_id': question['id'],
+            }
+            for question in question_rows if rng.random() < answer_rate
+        ]
+        db.session.execute(insert(Question), question_rows)
+        if answer_rows:
+            db.session.execute(insert(Answer), answer_rows)
+        db.session.commit()
+        next_question += k
+        asked += k
+        answered += len(answer_rows)
+    if report:
+        elapsed = max(time.monotonic() - started, 1e-6)
+        report(Question.__tablename__, asked, asked / elapsed)
+        report(Answer.__tablename__, answered, answered / elapsed)
+
+    rebuild_sales()
+
+
+@app.cli.command('seed')
+@click.option('--seed', 'seed', type=int, default=42, help='Semente do gerador; a mesma semente gera os mesmos dados.')
+@click.option('--users', type=int, default=1000)
+@click.option('--categories', type=int, default=20)
+@click.option('--ads', type=int, default=10000)
+@click.option('--favorites', type=int, default=20000)
+@click.option('--cart-items', type=int, default=5000)
+@click.option('--purchases', type=int, default=100000)
+@click.option('--questions', type=int, default=10000)
+@click.option('--answer-rate', type=float, default=0.7, help='Fração das perguntas respondidas.')
+@click.option('--end', default='2024-12-31', help='Último dia das compras (AAAA-MM-DD).')
+@click.option('--days', type=int, default=365, help='Dias de histórico de compras.')
+@click.option('--zipf', type=float, default=1.1, help='Expoente da popularidade dos anúncios.')
+@click.option('--batch-size', type=int, default=5000, help='Linhas por INSERT.')
+def seed_command(seed, users, categories, ads, favorites, cart_items, purchases, questions, answer_rate,
+                 end, days, zipf, batch_size):
+    if min(users, categories, ads) < 1:
+        raise click.BadParameter('são necessários ao menos um usuário, uma categoria e um anúncio.')
+
+    def report(table, count, rate):
+        print(f'{table}: {count} linhas ({rate:.0f} linhas/s)')
+
+    seed_database(
+        seed, users, categories, ads, favorites, cart_items, purchases, questions, answer_rate,
+        parse_day(end).date(), days, zipf, batch_size, report,
+    )
+    print(f'{DailySales.query.count()} dias e {AdSales.query.count()} anúncios resumidos.')
+
 
 def create_tables():
     with app.app_context():
         db.create_all()
+        migrations.upgrade(db.engine)
+        build_search_index()
+        build_facets()
+
+def ads_page(after=None, per_page=None, category_id=None, bucket=None):
+    per_page = per_page or app.config['ADS_PER_PAGE']
+    query = Ad.query.order_by(Ad.id.desc())
+    if after is not None:
+        query = query.filter(Ad.id < after)
+    if category_id is not None:
+        query = query.filter(Ad.category_id == category_id)
+    if bucket is not None:
+        low, high = facet_counts.bucket_range(bucket)
+        if low is not None:
+            query = query.filter(Ad.price >= low)
+        if high is not None:
+            query = query.filter(Ad.price < high)
+
+    ads = query.limit(per_page + 1).all()
+    next_cursor = ads[per_page - 1].id if len(ads) > per_page else None
+    return ads[:per_page], next_cursor
+
+
+def cached_ads_page(after=None, category_id=None, bucket=None):
+    def load():
+        ads, next_cursor = ads_page(after, category_id=category_id, bucket=bucket)
+        return [CachedAd(ad.id, ad.title, ad.description, ad.price, ad.image_path, ad.image_variants, ad.category_id)
+                for ad in ads], next_cursor
+
+    version = catalog_source()[0]
+    return query_cache.get_or_create('catalog', f'ads:{version}:{after}:{category_id}:{bucket}', load)
 
 @app.route('/')
+@read_only
+@query_budget(5)
+@conditional(versions.catalog)
 def index():
-    ads = Ad.query.all()
-    return render_template('index.html', ads=ads)
+    after = request.args.get('after', type=int)
+    category_id = request.args.get('category', type=int)
+    bucket = request.args.get('price', type=int)
+    if bucket is not None and not 0 <= bucket <= len(facet_counts.price_bounds):
+        bucket = None
+
+    if not facet_counts.built:
+        build_facets()
+    ads, next_cursor = cached_ads_page(after, category_id=category_id, bucket=bucket)
+
+    category_counts = facet_counts.categories(bucket)
+    categories = [(category, category_counts[category.id]) for category in all_categories() if category_counts[category.id]]
+    bucket_counts = facet_counts.buckets(category_id)
+    buckets = [(b, facet_counts.bucket_label(b), bucket_counts[b]) for b in sorted(bucket_counts)]
+
+    # Pop the flashes before streaming: the session cookie is written with the
+    # headers, before base.html gets to read them. Resolve the user too, so its
+    # query is counted before the SQL stats are reported with the headers.
+    get_flashed_messages()
+    current_user()
+    return app.response_class(stream_template(
+        'index.html', ads=ads, next_cursor=next_cursor, categories=categories, buckets=buckets,
+        category_id=category_id, bucket=bucket))
+
+@app.route('/search')
+@read_only
+@query_budget(5)
+def search():
+    q = request.args.get('q', '').strip()
+    ads = []
+    if q:
+        sync_catalog()
+        if not search_index.built:
+            build_search_index()
+        ranked = search_index.search(q, limit=app.config['ADS_PER_PAGE'])
+        found = {ad.id: ad for ad in Ad.query.filter(Ad.id.in_([ad_id for ad_id, _ in ranked])).all()}
+        ads = [found[ad_id] for ad_id, _ in ranked if ad_id in found]
+    return render_template('search.html', ads=ads, q=q)
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -164,20 +1115,445 @@ def register():
 
 
 @app.route('/admin/purchases')
+@query_budget(5)
 @admin_required
 def admin_purchases():
-    if 'user_id' not in session or not User.query.get(session['user_id']).is_admin:
-        return redirect(url_for('login'))
+    day = request.args.get('day')
+    ad_id = request.args.get('ad_id', type=int)
+    if day or ad_id:
+        after = request.args.get('after', type=int)
+        query = db.session.query(Purchase.id, Purchase.date, Purchase.value, Purchase.ad_id, User.username).join(
+            User, User.id == Purchase.user_id
+        ).order_by(Purchase.id.desc())
+        if day:
+            try:
+                start = parse_day(day)
+            except ValueError:
+                flash('Data inválida. Use o formato AAAA-MM-DD.', 'danger')
+                return redirect(url_for('admin_purchases'))
+            query = query.filter(Purchase.date >= start, Purchase.date < start + timedelta(days=1))
+        if ad_id:
+            query = query.filter(Purchase.ad_id == ad_id)
+        if after is not None:
+            query = query.filter(Purchase.id < after)
+
+        per_page = app.config['PURCHASES_PER_PAGE']
+        purchases = query.limit(per_page + 1).all()
+        next_cursor = purchases[per_page - 1].id if len(purchases) > per_page else None
+        return render_template('admin_purchase_detail.html', purchases=purchases[:per_page],
+                               day=day, ad_id=ad_id, next_cursor=next_cursor)
+
+    daily = DailySales.query.order_by(DailySales.day.desc()).limit(app.config['SALES_SUMMARY_DAYS']).all()
+    top_ads = db.session.query(AdSales.ad_id, AdSales.sales, AdSales.revenue, Ad.title).join(
+        Ad, Ad.id == AdSales.ad_id
+    ).order_by(AdSales.revenue.desc()).limit(app.config['SALES_SUMMARY_ADS']).all()
+    return render_template('admin_purchases.html', daily=daily, top_ads=top_ads)
+
+
+
+
+
+EXPORT_COLUMNS = ['id', 'date', 'username', 'ad_id', 'ad_title', 'value']
+
+
+def parse_day(value):
+    return datetime.strptime(value, '%Y-%m-%d') if value else None
+
+
+def export_purchases(fmt='csv', start=None, end=None, compress=False):
+    query = db.session.query(
+        Purchase.id, Purchase.date, User.username, Purchase.ad_id, Ad.title, Purchase.value
+    ).join(User, User.id == Purchase.user_id).join(Ad, Ad.id == Purchase.ad_id).order_by(Purchase.id)
+    if start:
+        query = query.filter(Purchase.date >= start)
+    if end:
+        query = query.filter(Purchase.date < end + timedelta(days=1))
+    batch_size = app.config['EXPORT_BATCH_SIZE']
+
+    def rows():
+        last = 0
+        while True:
+            chunk = query.filter(Purchase.id > last).limit(batch_size).all()
+            yield from chunk
+            if len(chunk) < batch_size:
+                return
+            last = chunk[-1].id
+
+    def lines():
+        if fmt == 'ndjson':
+            for row in rows():
+                record = dict(zip(EXPORT_COLUMNS, row))
+                record['date'] = record['date'].isoformat()
+                yield json.dumps(record, ensure_ascii=False) + '\n'
+            return
+
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS)
+        for row in rows():
+            writer.writerow(row)
+            if buffer.tell() >= 64 * 1024:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+    compressor = zlib.compressobj(wbits=31) if compress else None
+    for chunk in lines():
+        data = chunk.encode('utf-8')
+        if compressor:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
+
+
+@app.route('/admin/purchases/export')
+@admin_required
+def export_purchases_view():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in ('csv', 'ndjson'):
+        flash('Formato de exportação inválido.', 'danger')
+        return redirect(url_for('admin_purchases'))
+    compress = request.args.get('gzip') == '1'
+    try:
+        start = parse_day(request.args.get('start'))
+        end = parse_day(request.args.get('end'))
+    except ValueError:
+        flash('Data inválida. Use o formato AAAA-MM-DD.', 'danger')
+        return redirect(url_for('admin_purchases'))
+
+    filename = f'compras.{fmt}' + ('.gz' if compress else '')
+    mimetype = 'text/csv' if fmt == 'csv' else 'application/x-ndjson'
+    response = app.response_class(
+        stream_with_context(export_purchases(fmt, start, end, compress)),
+        mimetype='application/gzip' if compress else mimetype,
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
+
+@app.cli.command('export-purchases')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default='csv')
+@click.option('--start', help='Data inicial (AAAA-MM-DD).')
+@click.option('--end', help='Data final (AAAA-MM-DD).')
+@click.option('--gzip', 'compress', is_flag=True, help='Comprime a saída com gzip.')
+@click.option('--output', type=click.File('wb'), default='-')
+def export_purchases_command(fmt, start, end, compress, output):
+    for chunk in export_purchases(fmt, parse_day(start), parse_day(end), compress):
+        output.write(chunk)
+
+
+ImageSource = namedtuple('ImageSource', 'stream')
+_image_source = None
+
+
+def init_image_ingest(source):
+    global _image_source
+    _image_source = zipfile.ZipFile(source) if zipfile.is_zipfile(source) else source
+
+
+def ingest_image(name):
+    try:
+        if isinstance(_image_source, zipfile.ZipFile):
+            stream = _image_source.open(name)
+        else:
+            root = os.path.realpath(_image_source)
+            path = os.path.realpath(os.path.join(root, name))
+            if not path.startswith(root + os.sep):
+                raise UploadRejected('Caminho de imagem inválido.')
+            stream = open(path, 'rb')
+        with stream:
+            return name, store_image(ImageSource(stream)), None
+    except (UploadRejected, OSError, KeyError) as e:
+        return name, None, str(e)
+
+
+def read_import_rows(stream, fmt):
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if fmt == 'csv':
+        yield from csv.DictReader(text)
+        return
+    for line in text:
+        if line.strip():
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                yield None
+
+
+def import_format(filename):
+    return 'ndjson' if filename.lower().endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+def advance_checkpoint(source, rows, done):
+    updated = ImportCheckpoint.query.filter_by(source=source, rows=rows).update(
+        {ImportCheckpoint.rows: done, ImportCheckpoint.updated_at: datetime.utcnow()}, synchronize_session=False
+    )
+    if not updated:
+        db.session.rollback()
+        raise RuntimeError(f'O checkpoint de {source} foi alterado por outra importação.')
+
+
+def import_ads(source, rows, user_id, images=None, batch_size=None, processes=None, report=None):
+    batch_size = batch_size or app.config['IMPORT_BATCH_SIZE']
+    checkpoint = db.session.get(ImportCheckpoint, source)
+    if checkpoint is None:
+        checkpoint = ImportCheckpoint(source=source, rows=0)
+        db.session.add(checkpoint)
+        db.session.commit()
+    done = skip = checkpoint.rows
+    categories = {name: category_id for category_id, name in db.session.query(Category.id, Category.name)}
+    imported = failed = 0
+    queued = set()
+    stored = {}
+    started = time.monotonic()
+
+    pool = None
+    if images:
+        pool = multiprocessing.Pool(
+            processes or app.config['IMPORT_PROCESSES'], initializer=init_image_ingest, initargs=(images,)
+        )
+
+    def flush(batch):
+        nonlocal done, imported, failed
+        records = []
+        new_categories = False
+        for line, row in batch:
+            try:
+                title = row['title'].strip()
+                price = float(row['price'])
+                category = row['category'].strip()
+                if not title or not category or not math.isfinite(price) or price < 0:
+                    raise ValueError
+            except (KeyError, TypeError, ValueError, AttributeError):
+                failed += 1
+                app.logger.warning('Linha %s de %s ignorada: dados inválidos.', line, source)
+                continue
+            if category not in categories:
+                new_category = Category(name=category)
+                db.session.add(new_category)
+                db.session.flush()
+                categories[category] = new_category.id
+                new_categories = True
+            records.append({
+                'title': title,
+                'description': (row.get('description') or '').strip(),
+                'price': price,
+                'user_id': user_id,
+                'category_id': categories[category],
+                'image_path': (row.get('image') or '').strip() or None,
+            })
+
+        names = sorted({record['image_path'] for record in records if record['image_path']} - set(stored))
+        if names and pool:
+            for name, filename, error in pool.imap_unordered(ingest_image, names, chunksize=16):
+                if error:
+                    app.logger.warning('Imagem %s de %s ignorada: %s', name, source, error)
+                stored[name] = filename
+        for record in records:
+            record['image_path'] = stored.get(record['image_path'])
+
+        paths = {record['image_path'] for record in records if record['image_path']}
+        variants = dict(db.session.query(Ad.image_path, Ad.image_variants).filter(
+            Ad.image_path.in_(paths), Ad.image_variants.isnot(None)
+        )) if paths else {}
+        for record in records:
+            record['image_variants'] = variants.get(record['image_path'])
+
+        if records:
+            last_id = db.session.query(func.max(Ad.id)).scalar() or 0
+            db.session.execute(insert(Ad), records)
+            touch_catalog(*db.session.scalars(
+                select(Ad.id).where(Ad.id > last_id, Ad.user_id == user_id).order_by(Ad.id)
+            ))
+        pending = paths - set(variants) - queued
+        queued.update(pending)
+        if pending:
+            for ad_id, image_path in db.session.query(func.min(Ad.id), Ad.image_path).filter(
+                Ad.image_path.in_(pending)
+            ).group_by(Ad.image_path):
+                enqueue('image.variants', ad_id=ad_id, image_path=image_path)
+
+        advance_checkpoint(source, done, done + len(batch))
+        renew_job_lease()
+        db.session.commit()
+        if new_categories:
+            query_cache.invalidate('category')
+        done += len(batch)
+        imported += len(records)
+        if report:
+            report(done, imported, failed, imported / max(time.monotonic() - started, 1e-6))
+
+    try:
+        batch = []
+        for line, row in enumerate(rows, 1):
+            if line <= skip:
+                continue
+            batch.append((line, row))
+            if len(batch) >= batch_size:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    return done, imported, failed
+
+
+@job_handler('ads.import')
+def import_ads_job(path, user_id, images=None):
+    with open(path, 'rb') as f:
+        done, imported, failed = import_ads(path, read_import_rows(f, import_format(path)), user_id, images)
+    app.logger.info('Importação de %s concluída: %s linhas, %s anúncios, %s ignoradas.', path, done, imported, failed)
+    for leftover in (path, images):
+        if leftover:
+            os.remove(leftover)
+
+
+@app.cli.command('import-ads')
+@click.argument('input', type=click.Path(exists=True, dir_okay=False))
+@click.option('--images', type=click.Path(exists=True), help='Diretório ou arquivo .zip com as imagens.')
+@click.option('--user', 'username', required=True, help='Usuário dono dos anúncios importados.')
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default=None)
+@click.option('--batch-size', type=int, default=None, help='Linhas inseridas por transação.')
+@click.option('--processes', type=int, default=None, help='Processos para processar imagens.')
+@click.option('--restart', is_flag=True, help='Ignora o checkpoint e importa desde o início.')
+def import_ads_command(input, images, username, fmt, batch_size, processes, restart):
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.BadParameter(f'usuário {username} não encontrado.', param_hint='--user')
+    source = os.path.abspath(input)
+    if restart:
+        ImportCheckpoint.query.filter_by(source=source).delete()
+        db.session.commit()
 
-    purchases = Purchase.query.join(User).add_columns(
-        User.username, Purchase.date, Purchase.value, Purchase.ad_id
-    ).all()
+    def report(done, imported, failed, rate):
+        print(f'{done} linhas lidas, {imported} anúncios importados, {failed} ignoradas ({rate:.0f} linhas/s)')
 
-    return render_template('admin_purchases.html', purchases=purchases)
+    with open(source, 'rb') as f:
+        rows = read_import_rows(f, fmt or import_format(source))
+        done, imported, failed = import_ads(source, rows, user.id, images, batch_size, processes, report)
+    print(f'Importação concluída: {imported} anúncios, {failed} linhas ignoradas.')
 
 
+@app.route('/admin/ads/import', methods=['GET', 'POST'])
+@admin_required
+def import_ads_view():
+    if request.method == 'POST':
+        data = request.files.get('data')
+        if not data or not data.filename:
+            flash('Envie um arquivo CSV ou NDJSON.', 'danger')
+            return redirect(url_for('import_ads_view'))
+
+        import_folder = app.config['IMPORT_FOLDER']
+        os.makedirs(import_folder, mode=0o700, exist_ok=True)
+        os.chmod(import_folder, 0o700)
+        token = os.urandom(8).hex()
+        path = os.path.join(import_folder, f'{token}.{import_format(data.filename)}')
+        data.save(path)
+        images = None
+        archive = request.files.get('images')
+        if archive and archive.filename:
+            images = os.path.join(import_folder, f'{token}.zip')
+            archive.save(images)
+            if not zipfile.is_zipfile(images):
+                os.remove(path)
+                os.remove(images)
+                flash('As imagens devem ser enviadas em um arquivo .zip.', 'danger')
+                return redirect(url_for('import_ads_view'))
+
+        enqueue('ads.import', path=path, user_id=current_user().id, images=images)
+        db.session.commit()
+        flash('Importação agendada. Os anúncios aparecerão conforme forem processados.', 'success')
+        return redirect(url_for('import_ads_view'))
+
+    imports = ImportCheckpoint.query.order_by(ImportCheckpoint.updated_at.desc()).limit(20).all()
+    return render_template('import_ads.html', imports=imports)
 
 
+@app.route('/admin/metrics/pool')
+@admin_required
+def pool_metrics():
+    return jsonify(poolstats.pool_metrics(db))
+
+
+ProductChange = namedtuple('ProductChange', 'product name price')
+
+
+def product_filter(values):
+    query = Product.query
+    q = (values.get('q') or '').strip()
+    if q:
+        query = query.filter(Product.name.contains(q, autoescape=True))
+    min_price = values.get('min_price', type=float)
+    if min_price is not None:
+        query = query.filter(Product.price >= min_price)
+    max_price = values.get('max_price', type=float)
+    if max_price is not None:
+        query = query.filter(Product.price <= max_price)
+    return query
+
+
+def plan_product_batch(action, form):
+    if action == 'delete_many':
+        ids = form.getlist('product_ids', type=int)
+        products = Product.query.filter(Product.id.in_(ids)).order_by(Product.id).all() if ids else []
+        return [ProductChange(product, None, None) for product in products]
+
+    if action == 'edit_many':
+        submitted = {}
+        for key in form:
+            if key.startswith('name-'):
+                product_id = key[len('name-'):]
+                name = form[key].strip()
+                price = form.get(f'price-{product_id}', type=float)
+                if not product_id.isdigit() or not name or price is None or not math.isfinite(price) or price < 0:
+                    raise ValueError('Por favor, forneça nome e valor válidos para todos os produtos.')
+                submitted[int(product_id)] = (name, price)
+        products = Product.query.filter(Product.id.in_(submitted)).order_by(Product.id).all() if submitted else []
+        return [
+            ProductChange(product, *submitted[product.id]) for product in products
+            if submitted[product.id] != (product.name, product.price)
+        ]
+
+    if action == 'reprice':
+        percent = form.get('percent', type=float)
+        if percent is None or not math.isfinite(percent) or percent <= -100:
+            raise ValueError('Informe um percentual de reajuste válido.')
+        factor = 1 + percent / 100
+        products = product_filter(form).order_by(Product.id).all()
+        return [ProductChange(product, product.name, round(product.price * factor, 2)) for product in products]
+
+    raise ValueError('Operação inválida.')
+
+
+def product_batch_fields(action, form, changes):
+    if action == 'delete_many':
+        return [('product_ids', change.product.id) for change in changes]
+    if action == 'edit_many':
+        return [
+            field for change in changes
+            for field in ((f'name-{change.product.id}', change.name), (f'price-{change.product.id}', change.price))
+        ]
+    return [(key, form.get(key, '')) for key in ('q', 'min_price', 'max_price', 'percent')]
+
+
+def apply_product_batch(action, changes):
+    ids = [change.product.id for change in changes]
+    if action == 'delete_many':
+        Product.query.filter(Product.id.in_(ids)).delete(synchronize_session=False)
+    else:
+        values = {'price': case({change.product.id: change.price for change in changes}, value=Product.id)}
+        if action == 'edit_many':
+            values['name'] = case({change.product.id: change.name for change in changes}, value=Product.id)
+        db.session.execute(update(Product).where(Product.id.in_(ids)).values(**values))
+    db.session.commit()
+
 
 @app.route('/products', methods=['GET', 'POST'])
 def products():
@@ -190,6 +1566,26 @@ def products():
         name = request.form.get('name')
         price = request.form.get('price')
 
+        if action in ('delete_many', 'edit_many', 'reprice'):
+            try:
+                changes = plan_product_batch(action, request.form)
+            except ValueError as e:
+                flash(str(e), 'warning')
+                return redirect(url_for('products', **request.args))
+            if not changes:
+                flash('Nenhum produto a alterar.', 'info')
+                return redirect(url_for('products', **request.args))
+            if request.form.get('confirm') != '1':
+                return render_template(
+                    'products.html', products=product_filter(request.args).all(), filters=request.args,
+                    preview=changes, preview_action=action,
+                    preview_fields=product_batch_fields(action, request.form, changes),
+                )
+            apply_product_batch(action, changes)
+            done = 'excluídos' if action == 'delete_many' else 'atualizados'
+            flash(f'{len(changes)} produtos {done} com sucesso!', 'success')
+            return redirect(url_for('products', **request.args))
+
         if action == 'add':
             new_product = Product(name=name, price=price)
             db.session.add(new_product)
@@ -211,8 +1607,8 @@ def products():
             else:
                 flash('Por favor, forneça todos os campos obrigatórios.', 'warning')
 
-    products = Product.query.all()
-    return render_template('products.html', products=products)
+    products = product_filter(request.args).all()
+    return render_template('products.html', products=products, filters=request.args)
 
 @app.route('/edit/<int:product_id>', methods=['GET', 'POST'])
 def edit_product(product_id):
@@ -241,20 +1637,21 @@ def manage_ads():
         price = request.form['price']
         category_id = request.form['category_id']
         
-        image_path = None
-        if 'image' in request.files and allowed_file(request.files['image'].filename):
-            image = request.files['image']
-            filename = secure_filename(image.filename)
-            image_path = filename  
-            image.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-
-        new_ad = Ad(title=title, description=description, price=price, user_id=session['user_id'], category_id=category_id, image_path=image_path)
+        new_ad = Ad(title=title, description=description, price=price, user_id=session['user_id'], category_id=category_id)
         db.session.add(new_ad)
+        if 'image' in request.files and allowed_file(request.files['image'].filename):
+            try:
+                attach_image(new_ad, request.files['image'])
+            except UploadRejected as e:
+                db.session.rollback()
+                flash(str(e), 'danger')
+                return redirect(url_for('manage_ads'))
+        ad_saved(new_ad)
         db.session.commit()
         flash('Anúncio criado com sucesso!', 'success')
         return redirect(url_for('index'))
 
-    categories = Category.query.all()
+    categories = all_categories()
     ads = Ad.query.all()
     return render_template('manage_ads.html', ads=ads, categories=categories)
 
@@ -269,17 +1666,23 @@ def edit_ad(ad_id):
         ad.price = request.form['price']
         ad.category_id = request.form['category_id']
         
+        old_image_path = ad.image_path
         if 'image' in request.files and allowed_file(request.files['image'].filename):
-            image = request.files['image']
-            filename = secure_filename(image.filename)
-            image.save(os.path.join(app.config['UPLOAD_FOLDER'], filename))
-            ad.image_path = filename
+            try:
+                attach_image(ad, request.files['image'])
+            except UploadRejected as e:
+                db.session.rollback()
+                flash(str(e), 'danger')
+                return redirect(url_for('edit_ad', ad_id=ad_id))
         
+        if old_image_path and old_image_path != ad.image_path:
+            enqueue('image.release', image_path=old_image_path)
+        ad_saved(ad)
         db.session.commit()
         flash('Anúncio atualizado com sucesso!', 'success')
         return redirect(url_for('manage_ads'))
 
-    categories = Category.query.all()
+    categories = all_categories()
     return render_template('edit_ad.html', ad=ad, categories=categories)
 
 
@@ -287,13 +1690,15 @@ def edit_ad(ad_id):
 @admin_required
 def delete_ad(ad_id):
     ad = Ad.query.get_or_404(ad_id)
+    image_path = ad.image_path
 
-    if ad.image_path:
-        os.remove(os.path.join(app.config['UPLOAD_FOLDER'], ad.image_path))
-
+    forget_ad_sales(ad_id)
     Purchase.query.filter_by(ad_id=ad_id).delete()
 
     db.session.delete(ad)
+    if image_path:
+        enqueue('image.release', image_path=image_path)
+    ad_deleted(ad_id)
     db.session.commit()
     flash('Anúncio excluído com sucesso!', 'success')
     return redirect(url_for('manage_ads'))
@@ -312,9 +1717,10 @@ def manage_categories():
         new_category = Category(name=name)
         db.session.add(new_category)
         db.session.commit()
+        query_cache.invalidate('category')
         flash('Categoria criada com sucesso!', 'success')
 
-    categories = Category.query.all()
+    categories = all_categories()
     return render_template('manage_categories.html', categories=categories)
 
 @app.route('/favorites', methods=['GET', 'POST'])
@@ -368,23 +1774,26 @@ def purchase(ad_id):
         flash('Anúncio não encontrado.', 'danger')
         return redirect(url_for('manage_ads'))
 
-    purchase = Purchase(user_id=session['user_id'], ad_id=ad_id, value=ad.price)
+    now = datetime.utcnow()
+    purchase = Purchase(date=now, user_id=session['user_id'], ad_id=ad_id, value=ad.price)
     db.session.add(purchase)
+    db.session.flush()
+    record_sales(now, [(ad_id, 1, ad.price)])
+    enqueue('purchase.completed', user_id=session['user_id'], purchase_ids=[purchase.id])
     db.session.commit()
     flash('Compra registrada com sucesso!', 'success')
     return redirect(url_for('manage_ads'))
 
 @app.route('/add_to_cart/<int:ad_id>', methods=['POST'])
 def add_to_cart(ad_id):
-    quantity = int(request.form.get('quantity', 1)) 
+    if 'user_id' not in session:
+        return redirect(url_for('login'))
 
-    cart_item = CartItem.query.filter_by(ad_id=ad_id, user_id=session['user_id']).first()
-    if cart_item:
-        cart_item.quantity += quantity
-    else:
-        new_cart_item = CartItem(ad_id=ad_id, user_id=session['user_id'], quantity=quantity)
-        db.session.add(new_cart_item)
+    quantity = int(request.form.get('quantity', 1)) 
 
+    db.session.execute(upsert_add(CartItem, ['user_id', 'ad_id'], [
+        dict(user_id=session['user_id'], ad_id=ad_id, quantity=quantity)
+    ]))
     db.session.commit()
     flash('Item adicionado ao carrinho!', 'success')
     return redirect(url_for('cart'))
@@ -408,6 +1817,7 @@ def remove_from_cart(cart_item_id):
 
 
 @app.route('/cart')
+@query_budget(5)
 def cart():
     if 'user_id' not in session:
         return redirect(url_for('login'))
@@ -417,53 +1827,105 @@ def cart():
 
 
 @app.route('/purchase_all', methods=['POST'])
+@query_budget(8)
 def purchase_all():
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    cart_items = CartItem.query.filter_by(user_id=session['user_id']).all()
-    total_value = sum(item.ad.price * item.quantity for item in cart_items)
-
-    for item in cart_items:
-        purchase = Purchase(
-            date=datetime.utcnow(), 
-            user_id=session['user_id'], 
-            ad_id=item.ad_id, 
-            value=item.ad.price * item.quantity)
-        db.session.add(purchase)
-        db.session.delete(item)
-
+    user_id = session['user_id']
+    now = datetime.utcnow()
+    lines = db.session.query(CartItem.ad_id, CartItem.quantity, Ad.price).join(
+        Ad, Ad.id == CartItem.ad_id
+    ).filter(CartItem.user_id == user_id).with_for_update(of=CartItem).all()
+
+    if not lines:
+        flash('Seu carrinho está vazio.', 'warning')
+        return redirect(url_for('cart'))
+
+    values = [(ad_id, quantity, price * quantity) for ad_id, quantity, price in lines]
+    # Ids above last_id in this user's purchases are the rows inserted below.
+    last_id = db.session.query(func.max(Purchase.id)).filter(Purchase.user_id == user_id).scalar() or 0
+    db.session.execute(insert(Purchase), [
+        dict(date=now, user_id=user_id, ad_id=ad_id, quantity=quantity, value=value) for ad_id, quantity, value in values
+    ])
+    purchase_ids = db.session.scalars(
+        select(Purchase.id).where(Purchase.user_id == user_id, Purchase.id > last_id).order_by(Purchase.id)
+    ).all()
+    record_sales(now, values)
+    enqueue('purchase.completed', user_id=user_id, purchase_ids=purchase_ids)
+    CartItem.query.filter_by(user_id=user_id).delete(synchronize_session=False)
     db.session.commit()
     flash('Compra realizada com sucesso! Seu produto está a caminho.', 'success')
     return redirect(url_for('purchase_history'))
 
 
+HASHED_UPLOAD_RE = re.compile(r'^(variants/)?[0-9a-f]{64}(-\d+)?\.\w+$')
+
+
+@app.route('/uploads/<path:filename>')
+def uploaded_file(filename):
+    location = app.config['UPLOAD_ACCEL_LOCATION']
+    if not HASHED_UPLOAD_RE.match(filename):
+        return assets.send_asset(app.config['UPLOAD_FOLDER'], filename, location)
+
+    response = assets.send_asset(app.config['UPLOAD_FOLDER'], filename, location, max_age=app.config['UPLOAD_MAX_AGE'])
+    response.cache_control.immutable = True
+    return response
+
+
 @app.route('/ad/<int:ad_id>')
+@read_only
+@query_budget(5)
+@conditional(versions.ad)
 def ad_detail(ad_id):
     ad = Ad.query.get_or_404(ad_id)
     return render_template('ad_detail.html', ad=ad)
 
 
 
+def purchase_history_page(user_id, cursor=None, per_page=None):
+    per_page = per_page or app.config['PURCHASES_PER_PAGE']
+    query = Purchase.query.options(joinedload(Purchase.ad)).filter(Purchase.user_id == user_id).order_by(
+        Purchase.date.desc(), Purchase.id.desc()
+    )
+    if cursor:
+        date, purchase_id = cursor
+        query = query.filter(or_(
+            Purchase.date < date,
+            and_(Purchase.date == date, Purchase.id < purchase_id),
+        ))
+
+    purchases = query.limit(per_page + 1).all()
+    next_cursor = None
+    if len(purchases) > per_page:
+        last = purchases[per_page - 1]
+        next_cursor = f'{last.date.isoformat()}_{last.id}'
+    return purchases[:per_page], next_cursor
+
+
+def parse_history_cursor(value):
+    try:
+        date, purchase_id = value.rsplit('_', 1)
+        return datetime.fromisoformat(date), int(purchase_id)
+    except (AttributeError, ValueError):
+        return None
+
+
 @app.route('/purchase_history')
+@read_only
+@query_budget(5)
 def purchase_history():
     if 'user_id' not in session:
         return redirect(url_for('login'))
 
-    purchases = Purchase.query.filter_by(user_id=session['user_id']).all()
-    return render_template('purchase_history.html', purchases=purchases)
-
+    cursor = parse_history_cursor(request.args.get('cursor'))
+    purchases, next_cursor = purchase_history_page(session['user_id'], cursor)
+    return render_template('purchase_history.html', purchases=purchases, next_cursor=next_cursor)
 
 
 @app.route('/my_purchases')
 def my_purchases():
-    if 'user_id' not in session:
-        return redirect(url_for('login'))
-
-    user_id = session['user_id']
-    purchases = Purchase.query.filter_by(user_id=user_id).all()
-
-    return render_template('my_purchases.html', purchases=purchases)
+    return redirect(url_for('purchase_history', **request.args))
 
 
 
@@ -475,4 +1937,5 @@ def logout():
 
 if __name__ == '__main__':
     create_tables()
+    assets.precompress(app.static_folder)
     app.run(debug=True)
@@ -0,0 +1,89 @@
+import gzip
+import mimetypes
+import os
+
+from flask import abort, current_app, request, send_from_directory
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = {'.css', '.js', '.svg'}
+
+
+def _compressors():
+    yield '.gz', lambda data: gzip.compress(data, 9, mtime=0)
+    if brotli is not None:
+        yield '.br', lambda data: brotli.compress(data, quality=11)
+
+
+def precompress(folder):
+    written = 0
+    for root, _, files in os.walk(folder):
+        for name in files:
+            if os.path.splitext(name)[1] not in COMPRESSIBLE_EXTENSIONS:
+                continue
+            path = os.path.join(root, name)
+            data = None
+            for suffix, compress in _compressors():
+                target = path + suffix
+                if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(path):
+                    continue
+                if data is None:
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                with open(target + '.tmp', 'wb') as f:
+                    f.write(compress(data))
+                os.replace(target + '.tmp', target)
+                written += 1
+    return written
+
+
+def _accel_redirect(directory, filename, location, max_age):
+    path = safe_join(directory, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    response = current_app.response_class(mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+    response.headers['X-Accel-Redirect'] = location.rstrip('/') + '/' + filename
+    if max_age is not None:
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+    return response
+
+
+def send_asset(directory, filename, location, max_age=None):
+    if current_app.config['SENDFILE_MODE'] == 'x-accel':
+        return _accel_redirect(directory, filename, location, max_age)
+
+    if os.path.splitext(filename)[1] in COMPRESSIBLE_EXTENSIONS:
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            path = safe_join(directory, filename + suffix)
+            if request.accept_encodings[encoding] > 0 and path and os.path.isfile(path):
+                response = send_from_directory(
+                    directory, filename + suffix, mimetype=mimetypes.guess_type(filename)[0], max_age=max_age
+                )
+                response.headers['Content-Encoding'] = encoding
+                response.vary.add('Accept-Encoding')
+                return response
+
+    response = send_from_directory(directory, filename, max_age=max_age)
+    if os.path.splitext(filename)[1] in COMPRESSIBLE_EXTENSIONS:
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def _serve_static(filename):
+    app = current_app
+    return send_asset(app.static_folder, filename, app.config['STATIC_ACCEL_LOCATION'], app.get_send_file_max_age(filename))
+
+
+def init_app(app):
+    app.config['USE_X_SENDFILE'] = app.config['SENDFILE_MODE'] == 'x-sendfile'
+    app.view_functions['static'] = _serve_static
+
+    @app.cli.command('compress-static')
+    def compress_static_command():
+        print(f'{precompress(app.static_folder)} arquivos comprimidos.')
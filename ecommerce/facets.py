@@ -0,0 +1,73 @@
+from bisect import bisect_right
+from collections import Counter
+from threading import Lock
+
+
+class FacetCounts:
+    def __init__(self, price_bounds):
+        self.price_bounds = sorted(price_bounds)
+        self.built = False
+        self._ads = {}
+        self._counts = Counter()
+        self._lock = Lock()
+
+    def bucket_for(self, price):
+        return bisect_right(self.price_bounds, float(price))
+
+    def bucket_range(self, bucket):
+        low = self.price_bounds[bucket - 1] if bucket > 0 else None
+        high = self.price_bounds[bucket] if bucket < len(self.price_bounds) else None
+        return low, high
+
+    def bucket_label(self, bucket):
+        low, high = self.bucket_range(bucket)
+        if low is None:
+            return f'Até R$ {high:g}'
+        if high is None:
+            return f'Acima de R$ {low:g}'
+        return f'R$ {low:g} a {high:g}'
+
+    def build(self, rows):
+        with self._lock:
+            self._ads.clear()
+            self._counts.clear()
+            for ad_id, category_id, price in rows:
+                self._add(ad_id, category_id, price)
+            self.built = True
+
+    def add(self, ad_id, category_id, price):
+        with self._lock:
+            self._remove(ad_id)
+            self._add(ad_id, category_id, price)
+
+    def remove(self, ad_id):
+        with self._lock:
+            self._remove(ad_id)
+
+    def _add(self, ad_id, category_id, price):
+        key = (int(category_id), self.bucket_for(price))
+        self._ads[ad_id] = key
+        self._counts[key] += 1
+
+    def _remove(self, ad_id):
+        key = self._ads.pop(ad_id, None)
+        if key is not None:
+            self._counts[key] -= 1
+            if not self._counts[key]:
+                del self._counts[key]
+
+    def categories(self, bucket=None):
+        counts = Counter()
+        with self._lock:
+            for (category_id, ad_bucket), count in self._counts.items():
+                if bucket is None or ad_bucket == bucket:
+                    counts[category_id] += count
+        return counts
+
+    def buckets(self, category_id=None):
+        counts = Counter()
+        with self._lock:
+            for (ad_category, bucket), count in self._counts.items():
+                if category_id is None or ad_category == category_id:
+                    counts[bucket] += count
+        return counts
@@ -0,0 +1,133 @@
+from datetime import datetime
+
+from sqlalchemy import inspect, text
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def decorator(f):
+        MIGRATIONS.append((version, description, f))
+        return f
+    return decorator
+
+
+def _index_names(conn, table):
+    inspector = inspect(conn)
+    names = {index['name'] for index in inspector.get_indexes(table)}
+    return names | {constraint['name'] for constraint in inspector.get_unique_constraints(table)}
+
+
+def create_index(conn, table, name, columns, unique=False):
+    if name in _index_names(conn, table):
+        return
+
+    kind = 'UNIQUE INDEX' if unique else 'INDEX'
+    if conn.dialect.name == 'mysql':
+        cols = ', '.join(f'`{column}`' for column in columns)
+        conn.execute(text(f'ALTER TABLE `{table}` ADD {kind} `{name}` ({cols}), ALGORITHM=INPLACE, LOCK=NONE'))
+    else:
+        conn.execute(text(f'CREATE {kind} {name} ON {table} ({", ".join(columns)})'))
+
+
+def add_column(conn, table, column, ddl):
+    if column in {info['name'] for info in inspect(conn).get_columns(table)}:
+        return
+
+    if conn.dialect.name == 'mysql':
+        conn.execute(text(f'ALTER TABLE `{table}` ADD COLUMN `{column}` {ddl}, ALGORITHM=INPLACE, LOCK=NONE'))
+    else:
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {column} {ddl}'))
+
+
+def merge_duplicates(conn, table, columns, total=None):
+    group = ', '.join(columns)
+    select = f'SELECT {group}, MIN(id)' + (f', SUM({total})' if total else '')
+    duplicates = conn.execute(text(
+        f'{select} FROM {table} GROUP BY {group} HAVING COUNT(*) > 1'
+    )).all()
+
+    match = ' AND '.join(f'{column} = :{column}' for column in columns)
+    for row in duplicates:
+        params = dict(zip(columns, row))
+        params['keep'] = row[len(columns)]
+        if total:
+            conn.execute(text(f'UPDATE {table} SET {total} = :total WHERE id = :keep'), {**params, 'total': row[-1]})
+        conn.execute(text(f'DELETE FROM {table} WHERE {match} AND id <> :keep'), params)
+
+
+@migration(1, 'Ad.image_variants')
+def add_ad_image_variants(conn):
+    add_column(conn, 'ad', 'image_variants', 'VARCHAR(255)')
+
+
+@migration(2, 'Índices de chaves estrangeiras e filtros frequentes')
+def add_foreign_key_indexes(conn):
+    create_index(conn, 'ad', 'ix_ad_image_path', ['image_path'])
+    create_index(conn, 'purchase', 'ix_purchase_user_date', ['user_id', 'date', 'id'])
+    create_index(conn, 'purchase', 'ix_purchase_ad', ['ad_id'])
+    create_index(conn, 'question', 'ix_question_ad', ['ad_id'])
+    create_index(conn, 'answer', 'ix_answer_question', ['question_id'])
+
+
+@migration(3, 'Restrições únicas de carrinho e favoritos')
+def add_unique_constraints(conn):
+    merge_duplicates(conn, 'cart_item', ['user_id', 'ad_id'], total='quantity')
+    create_index(conn, 'cart_item', 'uq_cart_item_user_ad', ['user_id', 'ad_id'], unique=True)
+    merge_duplicates(conn, 'favorite', ['user_id', 'ad_id'])
+    create_index(conn, 'favorite', 'uq_favorite_user_ad', ['user_id', 'ad_id'], unique=True)
+
+
+@migration(4, 'Versão persistida do catálogo')
+def add_catalog_state(conn):
+    if conn.execute(text('SELECT COUNT(*) FROM catalog_state')).scalar() == 0:
+        conn.execute(
+            text('INSERT INTO catalog_state (id, version, modified) VALUES (1, 0, :modified)'),
+            {'modified': datetime.utcnow().replace(microsecond=0)},
+        )
+
+
+@migration(5, 'Índice de compras por data')
+def add_purchase_date_index(conn):
+    create_index(conn, 'purchase', 'ix_purchase_date', ['date', 'id'])
+
+
+@migration(6, 'Índices de anúncios por categoria e vendedor')
+def add_ad_indexes(conn):
+    create_index(conn, 'ad', 'ix_ad_category', ['category_id', 'id'])
+    create_index(conn, 'ad', 'ix_ad_user', ['user_id'])
+
+
+@migration(7, 'Purchase.quantity')
+def add_purchase_quantity(conn):
+    add_column(conn, 'purchase', 'quantity', 'INTEGER NOT NULL DEFAULT 1')
+
+
+def _ensure_version_table(engine):
+    with engine.begin() as conn:
+        conn.execute(text(
+            'CREATE TABLE IF NOT EXISTS schema_migrations ('
+            'version INTEGER PRIMARY KEY, description VARCHAR(255) NOT NULL, applied_at DATETIME NOT NULL)'
+        ))
+        return {version for version, in conn.execute(text('SELECT version FROM schema_migrations'))}
+
+
+def pending(engine):
+    applied = _ensure_version_table(engine)
+    return [(version, description) for version, description, _ in sorted(MIGRATIONS) if version not in applied]
+
+
+def upgrade(engine):
+    applied = _ensure_version_table(engine)
+    done = []
+    for version, description, f in sorted(MIGRATIONS):
+        if version in applied:
+            continue
+        with engine.begin() as conn:
+            f(conn)
+            conn.execute(
+                text('INSERT INTO schema_migrations (version, description, applied_at) VALUES (:version, :description, :applied_at)'),
+                {'version': version, 'description': description, 'applied_at': datetime.utcnow()},
+            )
+        done.append((version, description))
+    return done
@@ -0,0 +1,91 @@
+import time
+from threading import Lock
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+
+
+class PoolMetrics:
+    def __init__(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._lock = Lock()
+
+    def record_wait(self, seconds, timed_out=False):
+        with self._lock:
+            self.waits += 1
+            self.wait_total += seconds
+            self.wait_max = max(self.wait_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def incr(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self, pool):
+        return {
+            'size': pool.size(),
+            'checked_out': pool.checkedout(),
+            'checked_in': pool.checkedin(),
+            'overflow': max(pool.overflow(), 0),
+            'connects': self.connects,
+            'checkouts': self.checkouts,
+            'checkins': self.checkins,
+            'invalidations': self.invalidations,
+            'timeouts': self.timeouts,
+            'wait_avg_ms': round(self.wait_total / self.waits * 1000, 3) if self.waits else 0.0,
+            'wait_max_ms': round(self.wait_max * 1000, 3),
+        }
+
+
+class MeteredQueuePool(QueuePool):
+    metrics = None
+
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+
+    def _do_get(self):
+        if self.metrics is None:
+            return super()._do_get()
+
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except TimeoutError:
+            self.metrics.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        self.metrics.record_wait(time.perf_counter() - start)
+        return connection
+
+
+def _instrument(pool):
+    metrics = pool.metrics = PoolMetrics()
+    event.listen(pool, 'connect', lambda *args: metrics.incr('connects'))
+    event.listen(pool, 'checkout', lambda *args: metrics.incr('checkouts'))
+    event.listen(pool, 'checkin', lambda *args: metrics.incr('checkins'))
+    event.listen(pool, 'invalidate', lambda *args: metrics.incr('invalidations'))
+
+
+def pool_metrics(db):
+    return {
+        bind or 'default': engine.pool.metrics.snapshot(engine.pool)
+        for bind, engine in db.engines.items()
+        if isinstance(engine.pool, MeteredQueuePool) and engine.pool.metrics is not None
+    }
+
+
+def init_app(app, db):
+    with app.app_context():
+        for engine in db.engines.values():
+            if isinstance(engine.pool, MeteredQueuePool):
+                _instrument(engine.pool)
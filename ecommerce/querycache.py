@@ -0,0 +1,150 @@
+import hashlib
+import os
+import pickle
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from threading import Lock
+
+from cache import LRUCache
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+MISSING = object()
+
+
+class LocalBackend:
+    def __init__(self, maxsize=4096):
+        self._cache = LRUCache(maxsize)
+        self._locks = [Lock() for _ in range(64)]
+
+    def get(self, key):
+        entry = self._cache.get(key)
+        if entry is None or (entry[0] is not None and entry[0] < time.time()):
+            return MISSING
+        return entry[1]
+
+    def set(self, key, value, ttl=None):
+        self._cache.set(key, (time.time() + ttl if ttl else None, value))
+
+    @contextmanager
+    def lock(self, key):
+        with self._locks[hash(key) % len(self._locks)]:
+            yield
+
+
+class FileBackend:
+    def __init__(self, directory, prune_every=1000):
+        # Entries are unpickled on read, so nobody else may write here.
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        os.chmod(directory, 0o700)
+        self.directory = directory
+        self.prune_every = prune_every
+        self._writes = 0
+        self._locks = [Lock() for _ in range(64)]
+
+    def _path(self, key):
+        return os.path.join(self.directory, hashlib.sha1(key.encode('utf-8')).hexdigest())
+
+    def _load(self, path):
+        try:
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def get(self, key):
+        entry = self._load(self._path(key))
+        if entry is None or (entry[0] is not None and entry[0] < time.time()):
+            return MISSING
+        return entry[1]
+
+    def set(self, key, value, ttl=None):
+        fd, tmp = tempfile.mkstemp(dir=self.directory, prefix='.tmp-')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump((time.time() + ttl if ttl else None, value), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, self._path(key))
+
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def prune(self):
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if name.startswith('.') or name.endswith('.lock'):
+                continue
+            path = os.path.join(self.directory, name)
+            entry = self._load(path)
+            if entry is not None and entry[0] is not None and entry[0] < now:
+                for stale in (path, path + '.lock'):
+                    try:
+                        os.remove(stale)
+                    except FileNotFoundError:
+                        pass
+
+    @contextmanager
+    def lock(self, key):
+        with self._locks[hash(key) % len(self._locks)]:
+            if fcntl is None:
+                yield
+                return
+            with open(self._path(key) + '.lock', 'a') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+
+class QueryCache:
+    def __init__(self, backend, regions):
+        self.backend = backend
+        self.regions = regions
+        self.hits = 0
+        self.misses = 0
+
+    def _tag_version(self, tag):
+        key = f'tag:{tag}'
+        version = self.backend.get(key)
+        if version is MISSING:
+            version = uuid.uuid4().hex
+            self.backend.set(key, version)
+        return version
+
+    def _key(self, region, key, tags):
+        versions = ','.join(f'{tag}={self._tag_version(tag)}' for tag in sorted(tags))
+        return f'{region}:{key}|{versions}'
+
+    def get_or_create(self, region, key, creator, tags=()):
+        full_key = self._key(region, key, tags)
+        value = self.backend.get(full_key)
+        if value is not MISSING:
+            self.hits += 1
+            return value
+
+        with self.backend.lock(full_key):
+            value = self.backend.get(full_key)
+            if value is not MISSING:
+                self.hits += 1
+                return value
+            self.misses += 1
+            value = creator()
+            self.backend.set(full_key, value, self.regions[region])
+            return value
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            self.backend.set(f'tag:{tag}', uuid.uuid4().hex)
+
+
+def from_config(config):
+    if config['QUERY_CACHE_BACKEND'] == 'file':
+        backend = FileBackend(config['QUERY_CACHE_DIR'])
+    else:
+        backend = LocalBackend(config['QUERY_CACHE_SIZE'])
+    return QueryCache(backend, config['QUERY_CACHE_REGIONS'])
@@ -0,0 +1,64 @@
+import random
+import time
+from functools import wraps
+
+from flask import current_app, g, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.sql import Select
+
+
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and isinstance(clause, Select) and self._use_replica():
+            replica = self._replica()
+            if replica is not None:
+                return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+    def _replica(self):
+        # One replica per request: replicas lag by different amounts, so
+        # mixing them could show a page older than one already read.
+        if 'replica' not in g:
+            replicas = [engine for key, engine in self._db.engines.items() if key and key.startswith('replica')]
+            g.replica = random.choice(replicas) if replicas else None
+        return g.replica
+
+    def _use_replica(self):
+        if not has_request_context() or not g.get('use_replica') or g.get('db_wrote'):
+            return False
+        return not (self._flushing or self.new or self.dirty or self.deleted)
+
+
+def recently_wrote():
+    return time.time() - session.get('db_wrote_at', 0) < current_app.config['REPLICA_PIN_SECONDS']
+
+
+def read_only(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        g.use_replica = not recently_wrote()
+        return f(*args, **kwargs)
+    return decorated_function
+
+
+def _mark_write(*args):
+    if has_request_context():
+        g.db_wrote = True
+
+
+def _mark_orm_write(state):
+    if state.is_insert or state.is_update or state.is_delete:
+        _mark_write()
+
+
+def _pin_to_primary(response):
+    if g.get('db_wrote'):
+        session['db_wrote_at'] = time.time()
+    return response
+
+
+def init_app(app):
+    event.listen(RoutingSession, 'after_flush', _mark_write)
+    event.listen(RoutingSession, 'do_orm_execute', _mark_orm_write)
+    app.after_request(_pin_to_primary)
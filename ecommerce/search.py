@@ -0,0 +1,86 @@
+import heapq
+import math
+import re
+import unicodedata
+from collections import Counter
+from threading import RLock
+
+TOKEN_RE = re.compile(r'\w+')
+
+STOPWORDS = {
+    'a', 'ao', 'aos', 'as', 'com', 'da', 'das', 'de', 'do', 'dos', 'e', 'em',
+    'na', 'nas', 'no', 'nos', 'o', 'os', 'ou', 'para', 'pela', 'pelo', 'por',
+    'que', 'se', 'sem', 'um', 'uma', 'uns', 'umas',
+}
+
+
+def fold(text):
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+
+def tokenize(text):
+    return [token for token in TOKEN_RE.findall(fold(text or '')) if token not in STOPWORDS]
+
+
+class SearchIndex:
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.built = False
+        self._postings = {}
+        self._doc_terms = {}
+        self._doc_len = {}
+        self._total_len = 0
+        self._lock = RLock()
+
+    def build(self, docs):
+        with self._lock:
+            self._postings.clear()
+            self._doc_terms.clear()
+            self._doc_len.clear()
+            self._total_len = 0
+            for doc_id, text in docs:
+                self.add(doc_id, text)
+            self.built = True
+
+    def add(self, doc_id, text):
+        with self._lock:
+            self.remove(doc_id)
+            terms = Counter(tokenize(text))
+            for term, tf in terms.items():
+                self._postings.setdefault(term, {})[doc_id] = tf
+            length = sum(terms.values())
+            self._doc_terms[doc_id] = tuple(terms)
+            self._doc_len[doc_id] = length
+            self._total_len += length
+
+    def remove(self, doc_id):
+        with self._lock:
+            for term in self._doc_terms.pop(doc_id, ()):
+                postings = self._postings[term]
+                del postings[doc_id]
+                if not postings:
+                    del self._postings[term]
+            self._total_len -= self._doc_len.pop(doc_id, 0)
+
+    def search(self, query, limit=20):
+        with self._lock:
+            n = len(self._doc_len)
+            if not n:
+                return []
+            avgdl = self._total_len / n
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = self._postings.get(term)
+                if not postings:
+                    continue
+                df = len(postings)
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self._doc_len[doc_id] / avgdl)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+            return heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+
+    def __len__(self):
+        return len(self._doc_len)
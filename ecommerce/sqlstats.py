@@ -0,0 +1,85 @@
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, raiseload
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+def query_budget(limit):
+    def decorator(f):
+        f.query_budget = limit
+        return f
+    return decorator
+
+
+@contextmanager
+def unbudgeted():
+    if not has_request_context():
+        yield
+        return
+    g.sql_unbudgeted = g.get('sql_unbudgeted', 0) + 1
+    try:
+        yield
+    finally:
+        g.sql_unbudgeted -= 1
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    if not has_request_context():
+        return
+
+    stats = g.setdefault('sql_stats', {'count': 0, 'exempt': 0, 'time': 0.0, 'statements': Counter()})
+    stats['count'] += 1
+    if g.get('sql_unbudgeted'):
+        stats['exempt'] += 1
+    stats['time'] += elapsed
+    stats['statements'][statement] += 1
+
+
+def _do_orm_execute(state):
+    if not has_app_context() or not current_app.config['SQL_STRICT']:
+        return
+    if state.is_select and not state.is_relationship_load and not state.is_column_load:
+        state.statement = state.statement.options(raiseload('*'))
+
+
+def _report(response):
+    stats = g.pop('sql_stats', None)
+    if stats is None:
+        return response
+
+    app = current_app
+    for statement, times in stats['statements'].items():
+        if times >= app.config['SQL_REPEAT_THRESHOLD']:
+            app.logger.warning('Possível N+1 em %s: %d execuções de %s', request.endpoint, times, statement)
+
+    view = app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', None)
+    budgeted = stats['count'] - stats['exempt']
+    if budget is not None and budgeted > budget:
+        message = f'{request.endpoint} executou {budgeted} consultas (orçamento: {budget})'
+        if app.config['SQL_STRICT']:
+            raise QueryBudgetExceeded(message)
+        app.logger.warning(message)
+
+    response.headers.add('Server-Timing', f'db;dur={stats["time"] * 1000:.1f};desc="{stats["count"]} queries"')
+    return response
+
+
+def init_app(app):
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+    event.listen(Session, 'do_orm_execute', _do_orm_execute)
+    app.after_request(_report)
@@ -0,0 +1,112 @@
+import math
+import random
+from datetime import date, datetime, timedelta
+from itertools import accumulate, islice
+
+CATEGORY_NAMES = [
+    'Eletrônicos', 'Casa', 'Moda', 'Esportes', 'Informática', 'Celulares', 'Livros', 'Games',
+    'Brinquedos', 'Beleza', 'Automotivo', 'Ferramentas', 'Jardim', 'Pet Shop', 'Bebês', 'Música',
+    'Saúde', 'Papelaria', 'Alimentos', 'Móveis',
+]
+
+NOUNS = [
+    'cadeira', 'mesa', 'notebook', 'celular', 'tênis', 'camiseta', 'bicicleta', 'fone', 'monitor',
+    'teclado', 'sofá', 'luminária', 'mochila', 'relógio', 'panela', 'livro', 'violão', 'câmera',
+    'impressora', 'jaqueta', 'tapete', 'ventilador', 'cafeteira', 'console', 'patinete',
+]
+
+ADJECTIVES = [
+    'novo', 'usado', 'seminovo', 'original', 'importado', 'compacto', 'profissional', 'infantil',
+    'portátil', 'clássico', 'premium', 'básico', 'elétrico', 'confortável', 'resistente',
+]
+
+QUESTIONS = [
+    'Ainda está disponível?', 'Aceita troca?', 'Qual o prazo de entrega?', 'Tem garantia?',
+    'Faz por um preço menor?', 'Qual o estado de conservação?', 'Envia para todo o Brasil?',
+]
+
+ANSWERS = [
+    'Sim, ainda está disponível.', 'Não aceito trocas.', 'Envio em até 2 dias úteis.',
+    'Tem garantia de 90 dias.', 'O preço já está no mínimo.', 'Está em ótimo estado.',
+]
+
+MONTH_WEIGHTS = [0.8, 0.75, 0.9, 0.9, 1.1, 0.95, 1.0, 1.05, 0.95, 1.0, 1.6, 2.0]
+WEEKDAY_WEIGHTS = [1.0, 0.95, 0.95, 1.0, 1.1, 1.3, 1.25]
+HOUR_WEIGHTS = [
+    0.2, 0.1, 0.05, 0.05, 0.05, 0.1, 0.3, 0.6, 0.9, 1.0, 1.1, 1.2,
+    1.3, 1.2, 1.1, 1.1, 1.2, 1.3, 1.5, 1.8, 2.0, 1.9, 1.4, 0.7,
+]
+
+
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def zipf_weights(n, s=1.1):
+    return list(accumulate(1 / rank ** s for rank in range(1, n + 1)))
+
+
+def pareto_weights(rng, n, alpha=1.2):
+    return list(accumulate(rng.paretovariate(alpha) for _ in range(n)))
+
+
+def black_friday(year):
+    november_first = date(year, 11, 1)
+    first_thursday = november_first + timedelta(days=(3 - november_first.weekday()) % 7)
+    return first_thursday + timedelta(days=22)
+
+
+class SeasonalCalendar:
+    def __init__(self, start, end, growth=0.5):
+        self.days = [start + timedelta(days=n) for n in range((end - start).days + 1)]
+        peaks = {black_friday(year) for year in range(start.year, end.year + 1)}
+        weights = []
+        for n, day in enumerate(self.days):
+            weight = MONTH_WEIGHTS[day.month - 1] * WEEKDAY_WEIGHTS[day.weekday()]
+            weight *= 1 + growth * n / len(self.days)
+            if any(0 <= (day - peak).days <= 3 for peak in peaks):
+                weight *= 4
+            weights.append(weight)
+        self.day_weights = list(accumulate(weights))
+        self.hour_weights = list(accumulate(HOUR_WEIGHTS))
+
+    def sample(self, rng, k):
+        days = rng.choices(self.days, cum_weights=self.day_weights, k=k)
+        hours = rng.choices(range(24), cum_weights=self.hour_weights, k=k)
+        return [
+            datetime(day.year, day.month, day.day, hour, rng.randrange(60), rng.randrange(60))
+            for day, hour in zip(days, hours)
+        ]
+
+
+def category_name(n):
+    if n < len(CATEGORY_NAMES):
+        return CATEGORY_NAMES[n]
+    return f'{CATEGORY_NAMES[n % len(CATEGORY_NAMES)]} {n // len(CATEGORY_NAMES) + 1}'
+
+
+def ad_title(rng):
+    return f'{rng.choice(NOUNS).capitalize()} {rng.choice(ADJECTIVES)}'
+
+
+def ad_description(rng):
+    words = rng.choices(NOUNS + ADJECTIVES, k=rng.randint(8, 30))
+    return ' '.join(words).capitalize() + '.'
+
+
+def ad_price(rng):
+    return round(min(math.exp(rng.gauss(4.5, 1.2)), 50000), 2)
+
+
+def question_text(rng):
+    return rng.choice(QUESTIONS)
+
+
+def answer_text(rng):
+    return rng.choice(ANSWERS)
+
+
+def stream(seed, name):
+    return random.Random(f'{seed}:{name}')
@@ -0,0 +1,41 @@
+import time
+from threading import RLock
+
+
+class VersionTracker:
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.catalog_version = None
+        self.catalog_modified = None
+        self.lock = RLock()
+        self._floor = None
+        self._ads = {}
+        self._checked = None
+
+    def due(self):
+        return self._checked is None or time.monotonic() - self._checked >= self.interval
+
+    def expire(self):
+        self._checked = None
+
+    def catalog(self):
+        return self.catalog_version, self.catalog_modified
+
+    def ad(self, ad_id):
+        return self._ads.get(ad_id, self._floor)
+
+    def reset(self, version, modified):
+        with self.lock:
+            self._ads.clear()
+            self._floor = (version, modified)
+            self.catalog_version = version
+            self.catalog_modified = modified
+            self._checked = time.monotonic()
+
+    def apply(self, changes, version, modified):
+        with self.lock:
+            for change_version, ad_id in changes:
+                self._ads[ad_id] = (change_version, modified)
+            self.catalog_version = version
+            self.catalog_modified = modified
+            self._checked = time.monotonic()
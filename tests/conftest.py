@@ -0,0 +1,83 @@
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+from sqlalchemy import event, text
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'ecommerce'))
+
+WORKDIR = tempfile.mkdtemp(prefix='ecommerce-tests-')
+os.environ['DATABASE_URL'] = f'sqlite:///{os.path.join(WORKDIR, "test.sqlite")}'
+os.environ['UPLOAD_FOLDER'] = os.path.join(WORKDIR, 'uploads')
+os.environ['IMPORT_FOLDER'] = os.path.join(WORKDIR, 'imports')
+os.environ['QUERY_CACHE_BACKEND'] = 'local'
+
+import app as shop  # noqa: E402
+import querycache  # noqa: E402
+
+
+@pytest.fixture(scope='session', autouse=True)
+def workdir():
+    yield WORKDIR
+    shutil.rmtree(WORKDIR, ignore_errors=True)
+
+
+@pytest.fixture
+def app():
+    shop.app.config['SQL_STRICT'] = True
+    with shop.app.app_context():
+        shop.db.drop_all()
+        shop.db.session.execute(text('DROP TABLE IF EXISTS schema_migrations'))
+        shop.db.session.commit()
+        # Pooled SQLite connections keep the old schema cached.
+        shop.db.engine.dispose()
+    shop.versions.__init__(shop.app.config['CATALOG_SYNC_SECONDS'])
+    shop.card_cache.clear()
+    shop.identity_cache.clear()
+    shop.query_cache.backend = querycache.LocalBackend(shop.app.config['QUERY_CACHE_SIZE'])
+    shop.search_index.built = shop.facet_counts.built = False
+    shop.create_tables()
+    yield shop
+
+
+@pytest.fixture
+def catalog(app):
+    with app.app.app_context():
+        admin = app.User(username='admin', password='admin', is_admin=True)
+        buyer = app.User(username='buyer', password='buyer')
+        category = app.Category(name='Casa')
+        app.db.session.add_all([admin, buyer, category])
+        app.db.session.flush()
+        ads = [
+            app.Ad(title=f'Anúncio {n}', description='Descrição', price=10 + n, user_id=admin.id, category_id=category.id)
+            for n in range(30)
+        ]
+        app.db.session.add_all(ads)
+        app.db.session.commit()
+        return {'admin': admin.id, 'buyer': buyer.id, 'category': category.id, 'ads': [ad.id for ad in ads]}
+
+
+@pytest.fixture
+def client(app):
+    return app.app.test_client()
+
+
+def login(client, user_id):
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+
+
+@pytest.fixture
+def sql_statements(app):
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    with app.app.app_context():
+        engine = app.db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', record)
@@ -0,0 +1,44 @@
+import pytest
+from werkzeug.datastructures import MultiDict
+
+from conftest import login
+
+
+def test_bad_day_redirects_with_flash(app, catalog, client):
+    login(client, catalog['admin'])
+    response = client.get('/admin/purchases?day=bad')
+    assert response.status_code == 302
+    assert response.headers['Location'].endswith('/admin/purchases')
+    with client.session_transaction() as session:
+        assert session['_flashes'][0][0] == 'danger'
+
+
+@pytest.mark.parametrize('action, fields', [
+    ('edit_many', {'name-1': 'Produto', 'price-1': 'nan'}),
+    ('edit_many', {'name-1': 'Produto', 'price-1': 'inf'}),
+    ('reprice', {'percent': 'nan'}),
+    ('reprice', {'percent': 'inf'}),
+])
+def test_product_batch_rejects_non_finite_values(app, action, fields):
+    with app.app.app_context(), pytest.raises(ValueError):
+        app.plan_product_batch(action, MultiDict(fields))
+
+
+def test_reprice_writes_the_previewed_prices(app, catalog, client):
+    with app.app.app_context():
+        app.db.session.add_all([app.Product(name=f'Item {cents}', price=cents / 100) for cents in (30, 1, 99, 12345)])
+        app.db.session.add(app.Product(name='Fora do filtro', price=0.30))
+        app.db.session.commit()
+    form = MultiDict({'action': 'reprice', 'percent': '15', 'q': 'Item'})
+
+    with app.app.app_context():
+        preview = {change.product.id: change.price for change in app.plan_product_batch('reprice', form)}
+    login(client, catalog['admin'])
+    client.post('/products', data={**form, 'confirm': '1'})
+
+    with app.app.app_context():
+        stored = dict(app.db.session.query(app.Product.id, app.Product.price).filter(app.Product.name.startswith('Item')))
+        untouched = app.Product.query.filter_by(name='Fora do filtro').one().price
+    assert stored == preview
+    assert preview[min(preview)] == 0.34
+    assert untouched == 0.30
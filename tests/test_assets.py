@@ -0,0 +1,18 @@
+import gzip
+
+import assets
+
+
+def test_refused_encoding_is_not_served(app, tmp_path):
+    (tmp_path / 'site.css').write_text('body { color: red }')
+    (tmp_path / 'site.css.gz').write_bytes(gzip.compress(b'body { color: red }'))
+
+    def served(accept_encoding):
+        with app.app.test_request_context(headers={'Accept-Encoding': accept_encoding}):
+            response = assets.send_asset(str(tmp_path), 'site.css', '/_static/')
+            response.close()
+            return response.headers.get('Content-Encoding')
+
+    assert served('gzip') == 'gzip'
+    assert served('gzip;q=0, identity') is None
+    assert served('*;q=0.5') == 'gzip'
@@ -0,0 +1,52 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from conftest import login
+
+
+def test_concurrent_add_to_cart_keeps_one_row(app, catalog):
+    ad_id = catalog['ads'][0]
+    threads, clicks = 16, 25
+
+    def hammer(_):
+        client = app.app.test_client()
+        login(client, catalog['buyer'])
+        for _ in range(clicks):
+            assert client.post(f'/add_to_cart/{ad_id}', data={'quantity': 2}).status_code == 302
+
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(hammer, range(threads)))
+
+    with app.app.app_context():
+        items = app.CartItem.query.filter_by(user_id=catalog['buyer'], ad_id=ad_id).all()
+        assert len(items) == 1
+        assert items[0].quantity == threads * clicks * 2
+
+
+def test_add_to_cart_keeps_lines_per_ad(app, catalog, client):
+    login(client, catalog['buyer'])
+    for ad_id in catalog['ads'][:3]:
+        client.post(f'/add_to_cart/{ad_id}')
+    client.post(f'/add_to_cart/{catalog["ads"][0]}', data={'quantity': 3})
+
+    with app.app.app_context():
+        quantities = dict(app.db.session.query(app.CartItem.ad_id, app.CartItem.quantity).filter_by(user_id=catalog['buyer']))
+    assert quantities == {catalog['ads'][0]: 4, catalog['ads'][1]: 1, catalog['ads'][2]: 1}
+
+
+def test_sales_summaries_count_units_and_drop_empty_days(app, catalog, client):
+    first = catalog['ads'][0]
+    login(client, catalog['buyer'])
+    client.post(f'/add_to_cart/{first}', data={'quantity': 5})
+    client.post('/purchase_all')
+
+    with app.app.app_context():
+        assert app.db.session.get(app.AdSales, first).sales == 5
+        assert app.DailySales.query.one().sales == 5
+        app.rebuild_sales()
+        assert app.db.session.get(app.AdSales, first).sales == 5
+        assert app.DailySales.query.one().sales == 5
+
+    login(client, catalog['admin'])
+    client.post(f'/ads/delete/{first}')
+    with app.app.app_context():
+        assert app.DailySales.query.count() == 0
@@ -0,0 +1,70 @@
+from datetime import datetime, timedelta, timezone
+
+from conftest import login
+from werkzeug.http import http_date
+
+
+def test_catalog_revalidation_hit_issues_no_sql(app, catalog, client, sql_statements):
+    etag = client.get('/').headers['ETag']
+
+    sql_statements.clear()
+    response = client.get('/', headers={'If-None-Match': etag})
+
+    assert response.status_code == 304
+    assert sql_statements == []
+
+
+def test_ad_revalidation_hit_issues_no_sql(app, catalog, client, sql_statements):
+    client.get('/')
+    future = http_date(datetime.now(timezone.utc) + timedelta(days=1))
+
+    sql_statements.clear()
+    response = client.get(f'/ad/{catalog["ads"][0]}', headers={'If-Modified-Since': future})
+
+    assert response.status_code == 304
+    assert sql_statements == []
+
+
+def test_edit_changes_catalog_etag(app, catalog, client):
+    etag = client.get('/').headers['ETag']
+    login(client, catalog['admin'])
+    client.post(f'/ads/edit/{catalog["ads"][-1]}', data={
+        'title': 'Editado', 'description': 'Nova', 'price': '5', 'category_id': catalog['category'],
+    })
+    client.get('/')
+
+    response = client.get('/', headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
+    assert 'Editado' in response.get_data(as_text=True)
+
+
+def test_etag_survives_restart_only_while_catalog_is_unchanged(app, catalog, client):
+    etag = client.get('/').headers['ETag']
+    with app.app.app_context():
+        app.touch_catalog(catalog['ads'][0])
+        app.db.session.commit()
+    app.versions.__init__(app.app.config['CATALOG_SYNC_SECONDS'])
+
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+
+    response = client.get('/', headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304
+
+
+def test_writer_is_not_answered_from_an_unsynced_version(app, catalog, client):
+    login(client, catalog['admin'])
+    etag = client.get('/').headers['ETag']
+    stale = app.versions.catalog()
+    client.post(f'/ads/edit/{catalog["ads"][-1]}', data={
+        'title': 'Editado', 'description': 'Nova', 'price': '5', 'category_id': catalog['category'],
+    })
+    client.get('/')
+    # Another worker that has not synced since the edit.
+    app.versions.reset(*stale)
+
+    response = client.get('/', headers={'If-None-Match': etag})
+
+    assert response.status_code == 200
+    assert 'Editado' in response.get_data(as_text=True)
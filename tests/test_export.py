@@ -0,0 +1,22 @@
+import csv
+import io
+from datetime import datetime
+
+from conftest import login
+
+
+def test_export_walks_every_chunk(app, catalog, client, monkeypatch):
+    monkeypatch.setitem(app.app.config, 'EXPORT_BATCH_SIZE', 7)
+    with app.app.app_context():
+        app.db.session.execute(app.insert(app.Purchase), [
+            dict(date=datetime(2024, 1, 1 + n % 28), value=10, user_id=catalog['buyer'], ad_id=catalog['ads'][n % 30])
+            for n in range(50)
+        ])
+        app.db.session.commit()
+
+    login(client, catalog['admin'])
+    body = client.get('/admin/purchases/export').get_data(as_text=True)
+    rows = list(csv.reader(io.StringIO(body)))
+    assert rows[0] == app.EXPORT_COLUMNS
+    ids = [int(row[0]) for row in rows[1:]]
+    assert ids == sorted(ids) and len(ids) == 50
@@ -0,0 +1,58 @@
+import io
+import os
+import stat
+
+from conftest import login
+
+
+def test_imported_ads_reach_search_facets_and_etag(app, catalog, client):
+    etag = client.get('/').headers['ETag']
+    client.get('/search?q=anuncio')
+    rows = [{'title': f'Bicicleta importada {n}', 'price': '100', 'category': 'Esportes'} for n in range(25)]
+
+    with app.app.app_context():
+        assert app.import_ads('lote.csv', rows, catalog['admin'], batch_size=10) == (25, 25, 0)
+        changed = app.db.session.query(app.CatalogChange.ad_id).filter(app.CatalogChange.ad_id.isnot(None)).count()
+        sports = app.Category.query.filter_by(name='Esportes').one().id
+    assert changed == 25
+
+    response = client.get('/', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert 'Bicicleta importada 24' in response.get_data(as_text=True)
+    assert app.facet_counts.categories(None)[sports] == 25
+    client.get('/search?q=bicicleta')
+    assert len(app.search_index.search('bicicleta', limit=100)) == 25
+
+
+def test_malformed_ndjson_line_is_skipped(app, catalog):
+    data = io.BytesIO(
+        b'{"title": "Mesa", "price": "50", "category": "Casa"}\n'
+        b'{not json}\n'
+        b'{"title": "Cadeira", "price": "nan", "category": "Casa"}\n'
+        b'{"title": "Sof\\u00e1", "price": "900", "category": "Casa"}\n'
+    )
+
+    with app.app.app_context():
+        rows = app.read_import_rows(data, 'ndjson')
+        assert app.import_ads('lote.ndjson', rows, catalog['admin']) == (4, 2, 2)
+        assert app.db.session.get(app.ImportCheckpoint, 'lote.ndjson').rows == 4
+
+
+def test_admin_import_has_its_own_size_limit_and_private_folder(app, catalog, client, monkeypatch, tmp_path):
+    folder = tmp_path / 'imports'
+    folder.mkdir(mode=0o777)
+    os.chmod(folder, 0o777)
+    monkeypatch.setitem(app.app.config, 'IMPORT_FOLDER', str(folder))
+    monkeypatch.setitem(app.app.config, 'MAX_CONTENT_LENGTH', 1024)
+    login(client, catalog['admin'])
+    data = b'title,price,category\n' + b''.join(b'Cadeira %d,10,Casa\n' % n for n in range(200))
+
+    response = client.post('/admin/ads/import', data={'data': (io.BytesIO(data), 'lote.csv')})
+    assert response.status_code == 302
+    assert stat.S_IMODE(os.stat(folder).st_mode) == 0o700
+    with app.app.app_context():
+        assert app.Job.query.filter_by(kind='ads.import').count() == 1
+
+    client.post('/ads', data={'title': 'x' * 2048})
+    with client.session_transaction() as session:
+        assert session['_flashes'][-1] == ('danger', 'O envio excede o limite de 10 MB.')
@@ -0,0 +1,54 @@
+import json
+from datetime import datetime, timedelta
+
+from conftest import login
+
+
+def test_receipt_counts_only_the_checkout_purchases(app, catalog, client, caplog):
+    login(client, catalog['buyer'])
+    client.post(f'/purchase/{catalog["ads"][0]}')
+    for ad_id in catalog['ads'][1:4]:
+        client.post(f'/add_to_cart/{ad_id}')
+    client.post('/purchase_all')
+
+    with app.app.app_context():
+        jobs = app.Job.query.filter_by(kind='purchase.completed').order_by(app.Job.id).all()
+        assert [len(json.loads(job.payload)['purchase_ids']) for job in jobs] == [1, 3]
+        with caplog.at_level('INFO'):
+            assert app.run_jobs('teste', 10) == 2
+        assert app.Job.query.count() == 0
+    assert 'Recibo do usuário %d: 3 itens, total R$ 36.00' % catalog['buyer'] in caplog.text
+
+
+def test_reclaim_after_lease_uses_a_new_token(app):
+    with app.app.app_context():
+        app.enqueue('purchase.completed', user_id=1, purchase_ids=[])
+        app.db.session.commit()
+        first, = app.claim_jobs('teste', 10)
+        token = first.locked_by
+        assert token.startswith('teste:')
+
+        # Claims no longer match on locked_at, which DATETIME(0) truncates.
+        expired = datetime.utcnow() - timedelta(seconds=app.app.config['JOB_LEASE_SECONDS'] + 1)
+        app.db.session.execute(app.update(app.Job).values(locked_at=expired.replace(microsecond=0)))
+        app.db.session.commit()
+
+        second, = app.claim_jobs('teste', 10)
+        assert second.id == first.id
+        assert second.locked_by != token
+
+
+def test_job_that_lost_its_lease_leaves_the_new_owner_alone(app):
+    @app.job_handler('test.reclaimed')
+    def reclaimed():
+        app.Job.query.update({app.Job.locked_by: 'outro:abc'}, synchronize_session=False)
+        app.db.session.commit()
+        app.renew_job_lease()
+
+    with app.app.app_context():
+        app.enqueue('test.reclaimed')
+        app.db.session.commit()
+        assert app.run_jobs('teste', 10) == 1
+        job = app.Job.query.one()
+        assert (job.status, job.attempts, job.locked_by) == ('running', 0, 'outro:abc')
+    del app.job_handlers['test.reclaimed']
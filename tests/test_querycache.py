@@ -0,0 +1,20 @@
+import os
+import stat
+
+import querycache
+
+
+def test_file_backend_directory_is_private(tmp_path):
+    directory = tmp_path / 'query-cache'
+    directory.mkdir(mode=0o777)
+    os.chmod(directory, 0o777)
+
+    backend = querycache.FileBackend(str(directory))
+    backend.set('chave', 'valor')
+
+    assert stat.S_IMODE(os.stat(directory).st_mode) == 0o700
+    assert backend.get('chave') == 'valor'
+
+
+def test_default_directory_is_under_the_instance_path(app):
+    assert app.app.config['QUERY_CACHE_DIR'] == os.path.join(app.app.instance_path, 'query-cache')
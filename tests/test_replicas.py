@@ -0,0 +1,30 @@
+import sqlite3
+
+from sqlalchemy import create_engine
+
+from conftest import login
+
+
+def test_anonymous_reads_the_replica_and_the_writer_is_pinned(app, catalog, client, monkeypatch, tmp_path):
+    primary = app.app.config['SQLALCHEMY_DATABASE_URI'][len('sqlite:///'):]
+    replica = tmp_path / 'replica.sqlite'
+    with sqlite3.connect(primary) as source, sqlite3.connect(replica) as target:
+        source.backup(target)
+    engine = create_engine(f'sqlite:///{replica}')
+    with app.app.app_context():
+        # Binds are created when the app is set up, so the replica from
+        # DATABASE_REPLICA_URLS is registered here instead.
+        monkeypatch.setitem(app.db.engines, 'replica0', engine)
+
+    writer = app.app.test_client()
+    login(writer, catalog['admin'])
+    writer.post('/ads', data={
+        'title': 'Só no primário', 'description': 'Descrição', 'price': '10', 'category_id': catalog['category'],
+    })
+
+    assert 'Só no primário' not in client.get('/').get_data(as_text=True)
+    assert 'Só no primário' in writer.get('/').get_data(as_text=True)
+
+    monkeypatch.setitem(app.app.config, 'REPLICA_PIN_SECONDS', 0)
+    assert 'Só no primário' not in writer.get('/').get_data(as_text=True)
+    engine.dispose()
@@ -0,0 +1,32 @@
+import re
+
+import pytest
+from sqlalchemy.exc import InvalidRequestError
+
+import sqlstats
+from conftest import login
+
+
+def test_server_timing_counts_the_queries(app, catalog, client, sql_statements):
+    login(client, catalog['buyer'])
+    response = client.get('/')
+    response.get_data()
+
+    assert response.status_code == 200
+    count = int(re.search(r'desc="(\d+) queries"', response.headers['Server-Timing']).group(1))
+    assert count == len(sql_statements)
+
+
+def test_strict_mode_raises_on_budget_overrun(app, catalog, client, monkeypatch):
+    monkeypatch.setitem(app.app.config, 'PROPAGATE_EXCEPTIONS', True)
+    monkeypatch.setattr(app.app.view_functions['search'], 'query_budget', 0)
+
+    with pytest.raises(sqlstats.QueryBudgetExceeded):
+        client.get('/search?q=anuncio')
+
+
+def test_strict_mode_raises_on_lazy_load(app, catalog):
+    with app.app.app_context():
+        ad = app.db.session.get(app.Ad, catalog['ads'][0])
+        with pytest.raises(InvalidRequestError):
+            ad.user
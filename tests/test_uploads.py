@@ -0,0 +1,95 @@
+import hashlib
+import io
+import os
+import tracemalloc
+
+from PIL import Image
+
+from conftest import login
+
+BOUNDARY = 'limite'
+MB = 1024 * 1024
+
+
+def write_body(path, fields, filename, head, padding_mb):
+    """Writes a multipart body to disk and returns the SHA-256 of the file part."""
+    digest = hashlib.sha256(head)
+    with open(path, 'wb') as body:
+        for name, value in fields.items():
+            body.write(f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+        body.write(
+            f'--{BOUNDARY}\r\nContent-Disposition: form-data; name="image"; filename="{filename}"\r\n'
+            'Content-Type: image/png\r\n\r\n'.encode()
+        )
+        body.write(head)
+        for _ in range(padding_mb):
+            body.write(b'\0' * MB)
+            digest.update(b'\0' * MB)
+        body.write(f'\r\n--{BOUNDARY}--\r\n'.encode())
+    return digest.hexdigest()
+
+
+def png():
+    buffer = io.BytesIO()
+    Image.new('RGB', (1, 1)).save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def test_large_upload_streams_into_the_hashed_file(app, catalog, client, monkeypatch, tmp_path):
+    monkeypatch.setitem(app.app.config, 'UPLOAD_MAX_BYTES', 200 * MB)
+    monkeypatch.setitem(app.app.config, 'MAX_CONTENT_LENGTH', 256 * MB)
+    login(client, catalog['admin'])
+    head = png()
+    digest = write_body(
+        tmp_path / 'body', {'title': 'Imagem grande', 'description': 'Descrição', 'price': '10',
+                            'category_id': catalog['category']},
+        'grande.png', head, padding_mb=100,
+    )
+
+    with open(tmp_path / 'body', 'rb') as body:
+        tracemalloc.start()
+        try:
+            response = client.post('/ads', input_stream=body,
+                                   content_type=f'multipart/form-data; boundary={BOUNDARY}')
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    assert response.status_code == 302
+    assert peak < 4 * MB
+    filename = f'{digest}.png'
+    assert os.path.getsize(os.path.join(app.app.config['UPLOAD_FOLDER'], filename)) == 100 * MB + len(head)
+    with app.app.app_context():
+        assert app.Ad.query.filter_by(title='Imagem grande').one().image_path == filename
+    assert not [name for name in os.listdir(app.app.config['UPLOAD_FOLDER']) if name.startswith(app.UPLOAD_TMP_PREFIX)]
+
+
+def test_rejected_upload_leaves_no_temp_file(app, catalog, client):
+    login(client, catalog['admin'])
+    response = client.post('/ads', data={
+        'title': 'Sem imagem', 'description': 'Descrição', 'price': '10', 'category_id': catalog['category'],
+        'image': (io.BytesIO(b'texto'), 'falsa.png'),
+    })
+    assert response.status_code == 302
+    with app.app.app_context():
+        assert app.Ad.query.filter_by(title='Sem imagem').count() == 0
+    assert not [name for name in os.listdir(app.app.config['UPLOAD_FOLDER']) if name.startswith(app.UPLOAD_TMP_PREFIX)]
+
+
+def test_small_image_is_marked_and_not_requeued(app, catalog, client):
+    login(client, catalog['admin'])
+
+    def post(title):
+        client.post('/ads', data={
+            'title': title, 'description': 'Descrição', 'price': '10', 'category_id': catalog['category'],
+            'image': (io.BytesIO(png()), 'pequena.png'),
+        })
+
+    post('Pequena 1')
+    with app.app.app_context():
+        assert app.run_jobs('teste', 10) == 1
+    post('Pequena 2')
+
+    with app.app.app_context():
+        assert [ad.image_variants for ad in app.Ad.query.filter(app.Ad.title.startswith('Pequena'))] == ['', '']
+        assert app.Job.query.filter_by(kind='image.variants').count() == 0